@@ -1,28 +1,202 @@
-from src.antifraud import process_database
-from src.plot_graph import plot
-from src.payload import process_transaction
+import argparse
+import json
+import sys
 
-def main():
+# The commands import what they use when they run (matplotlib only for the report, pandas only with the engine),
+# so scoring a transaction starts without loading the rest
+
+# Rule parameters of the engine (see src.engine.ScoringEngine), passed as --amount-limit 1000 ...
+RULE_PARAMS = {
+    "amount_limit": float,
+    "time_window_hours": float,
+    "high_value": float,
+    "start_period": int,
+    "end_period": int,
+    "hours": float,
+    "limit": int,
+    "cbk_recent_days": float,
+    "cbk_limit": int,
+    "rotation_days": float,
+    "max_components": int,
+    "cbk_delay_days": float,
+}
+
+REPLAY_MODES = ("engine", "parallel", "chunked", "dataframe", "lazy", "vectorized")
+
+###################################################################################################################
+# Interactive menu (python main.py without a command)
+
+def menu():
     while True:
         print("=====================================================")
         print("1. Process transaction history")
         print("2. Generate statistical graphs")
         print("3. Test new transaction (process the history before)")
-        print("4. Exit")
+        print("4. Start scoring service (process the history before)")
+        print("5. Exit")
 
         choice = input("\nChoose an option: ")
 
         if choice == "1":
+            from src.antifraud import process_database
             process_database()
         elif choice == "2":
+            from src.plot_graph import plot
             plot()
         elif choice == "3":
+            from src.payload import process_transaction
             process_transaction()
         elif choice == "4":
+            from src.service import serve
+            serve()
+        elif choice == "5":
             print("Closing...")
             break
         else:
             print("Invalid option. Please try again.")
 
+###################################################################################################################
+# Commands
+
+def rule_params(args)-> dict:
+    return {name: getattr(args, name) for name in RULE_PARAMS if getattr(args, name) is not None}
+
+def replay(args):
+
+    from src.antifraud import INPUT_PATH, OUTPUT_PATH, process_database
+
+    profiler = None
+    if args.profile:
+        from src.profiling import RuleProfiler
+        profiler = RuleProfiler()
+
+    process_database(args.mode, input_path=args.input or INPUT_PATH, output_path=args.output or OUTPUT_PATH,
+                     profiler=profiler, chunk_rows=args.chunk_rows, checkpoint_rows=args.checkpoint_rows,
+                     resume=args.resume, workers=args.workers, all_rules=args.all_rules, **rule_params(args))
+
+def score(args):
+
+    from src.antifraud import OUTPUT_PATH
+    from src.payload import score_transaction
+
+    text = sys.stdin.read() if args.transaction == "-" else args.transaction
+    try:
+        decision = score_transaction(json.loads(text), args.history or OUTPUT_PATH, **rule_params(args))
+    except (ValueError, KeyError, TypeError, AttributeError) as error:
+        print(f"Invalid transaction: {error!r}", file=sys.stderr)
+        return 1
+    except OSError as error:
+        print(f"Could not read the history: {error}", file=sys.stderr)
+        return 1
+
+    print(json.dumps(decision))
+
+def stream(args):
+
+    from src.antifraud import OUTPUT_PATH
+    from src.stream import stream as score_stream
+
+    score_stream(args.input, args.output, None if args.empty_history else args.history or OUTPUT_PATH,
+                 **rule_params(args))
+
+def report(args):
+
+    from src.antifraud import OUTPUT_PATH
+    from src.plot_graph import GRAPH_DIR, plot
+
+    plot(args.history or OUTPUT_PATH, export_misses=not args.no_misses, graph_dir=args.graph_dir or GRAPH_DIR,
+         workers=args.workers, misses=args.misses)
+
+def serve(args):
+
+    from src.antifraud import OUTPUT_PATH
+    from src.scheduler import BATCH_MAX_SIZE
+    from src.service import HOST, PORT, serve as serve_forever
+
+    serve_forever(args.host or HOST, args.port or PORT, args.history or OUTPUT_PATH,
+                  batch_window_ms=args.batch_window_ms, batch_size=args.batch_size or BATCH_MAX_SIZE,
+                  **rule_params(args))
+
+###################################################################################################################
+
+def add_rule_params(parser):
+
+    group = parser.add_argument_group("rule parameters (engine defaults when omitted)")
+    for name, kind in RULE_PARAMS.items():
+        group.add_argument("--" + name.replace("_", "-"), dest=name, type=kind, metavar=kind.__name__.upper())
+
+def build_parser()-> argparse.ArgumentParser:
+
+    parser = argparse.ArgumentParser(prog="main.py", description="Anti-fraud transaction scoring "
+                                     "(without a command: interactive menu)")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+
+    # history -> result spreadsheet (or columnar store) written by replay
+    history = "processed history (default: ./data/transactional-result.csv)"
+
+    #-------------------------------------------------------------------------------------------------------------#
+    command = commands.add_parser("replay", help="score the transaction history and save the results")
+    command.add_argument("--input", help="transactions spreadsheet or store (default: "
+                                          "./data/transactional-sample.csv)")
+    command.add_argument("--output", help="results spreadsheet or store (default: ./data/transactional-result.csv)")
+    command.add_argument("--mode", choices=REPLAY_MODES, default="engine")
+    command.add_argument("--workers", type=int, help="processes of the parallel mode (default: one per CPU)")
+    command.add_argument("--chunk-rows", type=int, help="rows per chunk of the chunked mode")
+    command.add_argument("--checkpoint-rows", type=int, help="rows between checkpoints of the chunked mode")
+    command.add_argument("--resume", action="store_true", help="resume the chunked mode from its checkpoint")
+    command.add_argument("--all-rules", action="store_true", help="also save the bitmask of all the failing cases")
+    command.add_argument("--profile", action="store_true", help="print the time spent in each rule")
+    add_rule_params(command)
+    command.set_defaults(run=replay)
+
+    #-------------------------------------------------------------------------------------------------------------#
+    command = commands.add_parser("score", help="decide one transaction against the processed history")
+    command.add_argument("transaction", nargs="?", default="-",
+                         help="transaction as a JSON object (default: read from stdin)")
+    command.add_argument("--history", help=history)
+    add_rule_params(command)
+    command.set_defaults(run=score)
+
+    #-------------------------------------------------------------------------------------------------------------#
+    command = commands.add_parser("stream", help="score JSON lines transactions, each one added to the history")
+    command.add_argument("--input", default="-", help="JSON lines input (default: stdin)")
+    command.add_argument("--output", default="-", help="JSON lines decisions (default: stdout)")
+    command.add_argument("--history", help=history)
+    command.add_argument("--empty-history", action="store_true", help="start from an empty history")
+    add_rule_params(command)
+    command.set_defaults(run=stream)
+
+    #-------------------------------------------------------------------------------------------------------------#
+    command = commands.add_parser("report", help="save the statistical graphs of the processed history")
+    command.add_argument("--history", help=history)
+    command.add_argument("--graph-dir", help="directory of the graphs (default: ./data)")
+    command.add_argument("--misses", help="approved CBKs spreadsheet (default: in the graph directory, named after "
+                                          "the history)")
+    command.add_argument("--no-misses", action="store_true", help="do not export the approved CBKs spreadsheet")
+    command.add_argument("--workers", type=int, help="processes rendering the graphs")
+    command.set_defaults(run=report)
+
+    #-------------------------------------------------------------------------------------------------------------#
+    command = commands.add_parser("serve", help="start the HTTP scoring service")
+    command.add_argument("--host", help="(default: 127.0.0.1)")
+    command.add_argument("--port", type=int, help="(default: 8080)")
+    command.add_argument("--history", help=history)
+    command.add_argument("--batch-window-ms", type=float, help="answer concurrent requests in micro-batches")
+    command.add_argument("--batch-size", type=int, help="most requests in one micro-batch")
+    add_rule_params(command)
+    command.set_defaults(run=serve)
+
+    return parser
+
+def main(argv=None)-> int:
+
+    args = build_parser().parse_args(argv)
+
+    if args.command is None:
+        menu()
+        return 0
+
+    return args.run(args) or 0
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
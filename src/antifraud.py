@@ -1,10 +1,21 @@
+import time
+
 import pandas as pd
 import numpy as np
 
+from src.history import HistoryBuffer
+from src.metrics import DecisionMetrics, metrics_path
+from src.profiling import SLICING
+from src.store import is_store, open_store, write_store
+
 INPUT_PATH = "./data/transactional-sample.csv"
 OUTPUT_PATH = "./data/transactional-result.csv"
 CBK_DELAY_DAYS = 3
 
+# Seconds between two progress lines of a replay, and transactions counted at a time
+PROGRESS_SECONDS = 5
+PROGRESS_STEP = 4096
+
 ###################################################################################################################
 # Detect if a User, Card ou Device has a CBK sequence in their history
 
@@ -156,11 +167,42 @@ def has_component_rotation(main_component_history, previous_mt3d, transaction, c
 
 ###################################################################################################################
 
-def analyzes_transaction(transaction, previous)-> bool:
+# Keyword arguments are the tunable thresholds of the rules (same names as ScoringEngine and backtest.score_frame)
+# profiler -> optional src.profiling.RuleProfiler timing the history slicing and each rule
+# lazy     -> history views built on demand and cheapest rules first (same deny case, see analyzes_lazy)
+# all_rules -> every case is evaluated, returns the bitmask of the failing ones (bit case - 1) instead of the first
+def analyzes_transaction(transaction, previous, amount_limit=1000, time_window_hours=4, high_value=3500,
+                         start_period=21, end_period=4, hours=24, limit=3, cbk_recent_days=7, cbk_limit=5,
+                         rotation_days=7, max_components=2, cbk_delay_days=CBK_DELAY_DAYS, profiler=None,
+                         lazy=False, all_rules=False)-> bool:
+
+    if lazy and not all_rules:
+        return analyzes_lazy(transaction, previous, amount_limit, time_window_hours, high_value, start_period,
+                             end_period, hours, limit, cbk_recent_days, cbk_limit, rotation_days, max_components,
+                             cbk_delay_days, profiler)
+
+    if profiler is not None:
+        profiler.transactions += 1
 
     if previous.empty:
         return 0
 
+    # Rules are called through the profiler when there is one
+    check = call_rule if profiler is None else profiler.call
+
+    # With all_rules a failing case is recorded and the evaluation goes on
+    fired = 0
+    if all_rules:
+        call = call_rule if profiler is None else profiler.measure
+
+        def check(case, rule, *args)-> bool:
+            nonlocal fired
+            if not call(case, rule, *args):
+                fired |= 1 << (case - 1)
+            return True
+
+    slicing_start = time.perf_counter_ns()
+
     #=============================================================================================================#
     # Transaction history
 
@@ -177,7 +219,7 @@ def analyzes_transaction(transaction, previous)-> bool:
     # Assuming we have the Chargeback information in 3 days (hypothetically)
     # Trasactions with more than 3 days
     previous_mt3d = previous[
-        (previous["transaction_date"] <= transaction["transaction_date"] - pd.Timedelta(days=CBK_DELAY_DAYS))]
+        (previous["transaction_date"] <= transaction["transaction_date"] - pd.Timedelta(days=cbk_delay_days))]
 
     merchant_history_cbk = pd.DataFrame()
     user_history_cbk = pd.DataFrame()
@@ -195,117 +237,284 @@ def analyzes_transaction(transaction, previous)-> bool:
         if not pd.isna(transaction["device_id"]):
             device_history_cbk = previous_mt3d[previous_mt3d["device_id"] == transaction["device_id"]]
 
+    if profiler is not None:
+        profiler.record(SLICING, time.perf_counter_ns() - slicing_start)
+
     #=============================================================================================================#
     # Security cases
 
     # Case 1: two or more transactions that exceed the value limit in a period
-    if not has_exceeded_limit(transaction, previous, amount_limit = 1000, time_window_hours = 4):
+    if not check(1, has_exceeded_limit, transaction, previous, amount_limit, time_window_hours):
         return 1
     
     #---------------------------------------------------------------------------------------------------------#
     # Case 2: High value for the period
-    if not too_late(transaction):
+    if not check(2, too_late, transaction, high_value, start_period, end_period):
         return 2
 
     #---------------------------------------------------------------------------------------------------------#
     # Case 3: User made many transactions in a period
-    if not has_many_transactions(user_history, transaction):
+    if not check(3, has_many_transactions, user_history, transaction, hours, limit):
         return 3
     
     #---------------------------------------------------------------------------------------------------------#
     # Case 4: Card made many transactions in a period
-    if not has_many_transactions(card_history, transaction):
+    if not check(4, has_many_transactions, card_history, transaction, hours, limit):
         return 4
     
     #---------------------------------------------------------------------------------------------------------#
     # Case 5: Device made many transactions in a period
-    if not has_many_transactions(device_history, transaction):
+    if not check(5, has_many_transactions, device_history, transaction, hours, limit):
         return 5
 
     #---------------------------------------------------------------------------------------------------------#
     # Case 6: User with more than 1 CBK in 7 days
-    if not has_many_cbks(user_history_cbk, transaction):
+    if not check(6, has_many_cbks, user_history_cbk, transaction, cbk_recent_days):
         return 6
     
     #---------------------------------------------------------------------------------------------------------#
     # Case 7: Card with more than 1 CBK in 7 days
-    if not has_many_cbks(card_history_cbk, transaction):
+    if not check(7, has_many_cbks, card_history_cbk, transaction, cbk_recent_days):
         return 7
     
     #---------------------------------------------------------------------------------------------------------#
     # Case 8: Device with more than 1 CBK in 7 days
-    if not has_many_cbks(device_history_cbk, transaction):
+    if not check(8, has_many_cbks, device_history_cbk, transaction, cbk_recent_days):
         return 8
 
     #---------------------------------------------------------------------------------------------------------#
     # Case 9: User with more than 5 CBK in their history
-    if not global_cbks(user_history_cbk):
+    if not check(9, global_cbks, user_history_cbk, cbk_limit):
         return 9
 
     #---------------------------------------------------------------------------------------------------------#
     # Case 10: Card with more than 5 CBK in their history
-    if not global_cbks(card_history_cbk):
+    if not check(10, global_cbks, card_history_cbk, cbk_limit):
         return 10
 
     #---------------------------------------------------------------------------------------------------------#
     # Case 11: Device with more than 5 CBK in their history
-    if not global_cbks(device_history_cbk):
+    if not check(11, global_cbks, device_history_cbk, cbk_limit):
         return 11
     
     #---------------------------------------------------------------------------------------------------------#
     # Case 12: User with many cards
-    u_many_cards = has_component_rotation(user_history, previous_mt3d, transaction, "card_number")
+    u_many_cards = check(12, has_component_rotation, user_history, previous_mt3d, transaction, "card_number",
+                         rotation_days, max_components)
     if (not u_many_cards):
         return 12
     
     #---------------------------------------------------------------------------------------------------------#
     # Case 13: User with many devices
-    u_many_devices = has_component_rotation(user_history, previous_mt3d, transaction, "device_id")
+    u_many_devices = check(13, has_component_rotation, user_history, previous_mt3d, transaction, "device_id",
+                           rotation_days, max_components)
     if (not u_many_devices):
         return 13
     
     #---------------------------------------------------------------------------------------------------------#
     # Case 14: Card with many devices
-    c_many_devices = has_component_rotation(card_history, previous_mt3d, transaction, "device_id")
+    c_many_devices = check(14, has_component_rotation, card_history, previous_mt3d, transaction, "device_id",
+                           rotation_days, max_components)
     if (not c_many_devices):
         return 14
 
     #---------------------------------------------------------------------------------------------------------#
     # Case 15: Card with many users
-    c_many_users = has_component_rotation(card_history, previous_mt3d, transaction, "user_id")
+    c_many_users = check(15, has_component_rotation, card_history, previous_mt3d, transaction, "user_id",
+                         rotation_days, max_components)
     if (not c_many_users):
         return 15
         
     #---------------------------------------------------------------------------------------------------------#
     # Case 16: Device with many users
     if not device_history.empty:
-        d_many_users = has_component_rotation(device_history, previous_mt3d, transaction, "user_id")
+        d_many_users = check(16, has_component_rotation, device_history, previous_mt3d, transaction, "user_id",
+                             rotation_days, max_components)
         if (not d_many_users):
-            return  16
+            return 16
 
     #---------------------------------------------------------------------------------------------------------#
     # Case 17: Device with many cards
     if not device_history.empty:
-        d_many_cards = has_component_rotation(device_history, previous_mt3d, transaction, "card_number")
+        d_many_cards = check(17, has_component_rotation, device_history, previous_mt3d, transaction, "card_number",
+                             rotation_days, max_components)
         if (not d_many_cards):
             return 17
 
     #---------------------------------------------------------------------------------------------------------#
     # Case 18: Merchant with more than 1 CBK in 7 days
-    if not has_many_cbks(merchant_history_cbk, transaction):
+    if not check(18, has_many_cbks, merchant_history_cbk, transaction, cbk_recent_days):
         return 18
     
     #---------------------------------------------------------------------------------------------------------#
     
-    # Transaction approved
-    return 0
+    # Transaction approved (with all_rules, denied by the first failing case)
+    if profiler is not None:
+        profiler.decide(first_case(fired))
+
+    return fired
+
+# Rule call without profiling
+def call_rule(case, rule, *args)-> bool:
+    return rule(*args)
+
+# deny_case of a bitmask of failing cases (the first one in priority order, 0 when none failed)
+def first_case(fired)-> int:
+    return (fired & -fired).bit_length()
 
 ###################################################################################################################
+# History views of one transaction, sliced the first time a rule asks for them and reused by the next rules
+# The user / card / device histories come from a single scan for rows sharing any of the components (same rows,
+# in the same order, as filtering the whole history for each one)
+
+class TransactionViews:
+
+    def __init__(self, transaction, previous, cbk_delay_days=CBK_DELAY_DAYS, profiler=None):
+        self.transaction = transaction
+        self.previous = previous
+        self.cutoff = transaction["transaction_date"] - pd.Timedelta(days=cbk_delay_days)
+        self.profiler = profiler
+        self.views = {}
+        self.depth = 0
+
+    def __getitem__(self, name):
+
+        view = self.views.get(name)
+
+        if view is None:
+            start = time.perf_counter_ns()
+            self.depth += 1
+            view = self.views[name] = getattr(self, "_" + name)()
+            self.depth -= 1
 
-def process_database():
+            # Nested views are already part of the outer one
+            if self.profiler is not None and self.depth == 0:
+                self.profiler.record(SLICING, time.perf_counter_ns() - start)
 
-    # Reading the spreadsheet
-    df = pd.read_csv(INPUT_PATH, parse_dates=["transaction_date"])
+        return view
+
+    #=============================================================================================================#
+
+    def _related(self):
+        previous = self.previous
+        transaction = self.transaction
+        return previous[(previous["user_id"] == transaction["user_id"])
+                        | (previous["card_number"] == transaction["card_number"])
+                        | (previous["device_id"] == transaction["device_id"])]
+
+    def _user_history(self):
+        related = self["related"]
+        return related[related["user_id"] == self.transaction["user_id"]]
+
+    def _card_history(self):
+        related = self["related"]
+        return related[related["card_number"] == self.transaction["card_number"]]
+
+    def _device_history(self):
+        if pd.isna(self.transaction["device_id"]):
+            return pd.DataFrame()
+        related = self["related"]
+        return related[related["device_id"] == self.transaction["device_id"]]
+
+    # Assuming we have the Chargeback information in 3 days (hypothetically)
+    def _previous_mt3d(self):
+        return self.previous[self.previous["transaction_date"] <= self.cutoff]
+
+    def _user_history_cbk(self):
+        return self.matured(self["user_history"])
+
+    def _card_history_cbk(self):
+        return self.matured(self["card_history"])
+
+    def _device_history_cbk(self):
+        return self.matured(self["device_history"])
+
+    def _merchant_history_cbk(self):
+        previous_mt3d = self["previous_mt3d"]
+        return previous_mt3d[previous_mt3d["merchant_id"] == self.transaction["merchant_id"]]
+
+    # Rows of a component history with more than 3 days
+    def matured(self, history):
+        if history.empty:
+            return pd.DataFrame()
+        return history[history["transaction_date"] <= self.cutoff]
+
+# Same decision as analyzes_transaction
+# Rules run from the cheapest (no history, then the rows sharing a component, then the matured history scan) and
+# rules after a failing case are skipped while the ones before it still run, so the deny case is still the first
+# failing rule in case order
+def analyzes_lazy(transaction, previous, amount_limit=1000, time_window_hours=4, high_value=3500, start_period=21,
+                  end_period=4, hours=24, limit=3, cbk_recent_days=7, cbk_limit=5, rotation_days=7,
+                  max_components=2, cbk_delay_days=CBK_DELAY_DAYS, profiler=None)-> int:
+
+    if profiler is not None:
+        profiler.transactions += 1
+
+    if previous.empty:
+        return 0
+
+    # A failing rule can be overtaken by a lower case run after it, the deny case is recorded once at the end
+    check = call_rule if profiler is None else profiler.measure
+    views = TransactionViews(transaction, previous, cbk_delay_days, profiler)
+
+    # The rotation of the device components is only checked when the device has history
+    def device_rotation(component):
+        device_history = views["device_history"]
+        if device_history.empty:
+            return True
+        return has_component_rotation(device_history, views["previous_mt3d"], transaction, component,
+                                      rotation_days, max_components)
+
+    rules = (
+        (2, lambda: too_late(transaction, high_value, start_period, end_period)),
+        (1, lambda: has_exceeded_limit(transaction, views["related"], amount_limit, time_window_hours)),
+        (3, lambda: has_many_transactions(views["user_history"], transaction, hours, limit)),
+        (4, lambda: has_many_transactions(views["card_history"], transaction, hours, limit)),
+        (5, lambda: has_many_transactions(views["device_history"], transaction, hours, limit)),
+        (9, lambda: global_cbks(views["user_history_cbk"], cbk_limit)),
+        (10, lambda: global_cbks(views["card_history_cbk"], cbk_limit)),
+        (11, lambda: global_cbks(views["device_history_cbk"], cbk_limit)),
+        (6, lambda: has_many_cbks(views["user_history_cbk"], transaction, cbk_recent_days)),
+        (7, lambda: has_many_cbks(views["card_history_cbk"], transaction, cbk_recent_days)),
+        (8, lambda: has_many_cbks(views["device_history_cbk"], transaction, cbk_recent_days)),
+        (12, lambda: has_component_rotation(views["user_history"], views["previous_mt3d"], transaction,
+                                            "card_number", rotation_days, max_components)),
+        (13, lambda: has_component_rotation(views["user_history"], views["previous_mt3d"], transaction,
+                                            "device_id", rotation_days, max_components)),
+        (14, lambda: has_component_rotation(views["card_history"], views["previous_mt3d"], transaction,
+                                            "device_id", rotation_days, max_components)),
+        (15, lambda: has_component_rotation(views["card_history"], views["previous_mt3d"], transaction,
+                                            "user_id", rotation_days, max_components)),
+        (16, lambda: device_rotation("user_id")),
+        (17, lambda: device_rotation("card_number")),
+        (18, lambda: has_many_cbks(views["merchant_history_cbk"], transaction, cbk_recent_days)),
+    )
+
+    status = 0
+    for case, rule in rules:
+
+        # A rule after the current deny case can no longer change the decision
+        if status and case > status:
+            continue
+
+        if not check(case, rule):
+            status = case
+
+    if profiler is not None:
+        profiler.decide(status)
+
+    return status
+
+###################################################################################################################
+
+# Transactions of the input spreadsheet in processing order
+def read_input(input_path=INPUT_PATH):
+
+    # Reading the spreadsheet (or the columnar store, see src.store)
+    if is_store(input_path):
+        df = open_store(input_path).read()
+    else:
+        df = pd.read_csv(input_path, parse_dates=["transaction_date"])
     df = df.sort_values(by="transaction_date", ascending=True).reset_index(drop=True)
 
     # Converting CBK column from str to bool
@@ -313,14 +522,135 @@ def process_database():
     # Replace blank device_id to Numpy NaN
     df["device_id"] = df["device_id"].replace("", np.nan)
 
-    # Dataframe with the results
-    historical = pd.DataFrame(columns=df.columns)
-    historical = historical.astype(df.dtypes.to_dict())
+    return df
+
+###################################################################################################################
+# Periodic throughput line of a replay instead of one print per transaction
+
+class ProgressReport:
 
-    for i, transaction in df.iterrows():
+    # done -> transactions already processed (a resumed replay continues its count)
+    def __init__(self, done=0, seconds=PROGRESS_SECONDS):
+        self.done = done
+        self.seconds = seconds
+        self.start = self.last = time.perf_counter()
+        self.started = done
+        # Transactions counted by the last line printed
+        self.reported = None
+
+    def add(self, rows):
+
+        self.done += rows
+
+        now = time.perf_counter()
+        if now - self.last >= self.seconds:
+            self.last = now
+            self.report(now)
+
+    def report(self, now):
+        rate = (self.done - self.started) / max(now - self.start, 1e-9)
+        print(f"{self.done} transactions processed | {rate:.0f} transactions/s")
+        self.reported = self.done
+
+    # Final line, unless the last periodic one already counted every transaction
+    def finish(self):
+        if self.reported != self.done:
+            self.report(time.perf_counter())
+
+###################################################################################################################
+
+# params     -> rule thresholds passed to analyzes_transaction / ScoringEngine / backtest.score_frame
+# profiler   -> optional src.profiling.RuleProfiler, filled during the replay and printed at the end
+#               (the vectorized mode has no per-rule calls to time)
+# chunk_rows -> transactions held in memory at a time by the "chunked" mode
+# checkpoint_rows, resume -> checkpoints of the "chunked" mode and continuing from the last one (see src.chunked)
+# workers    -> processes of the "parallel" mode (default: one per CPU)
+# all_rules  -> evaluate every case, not only up to the first failing one, and add the fired_rules column
+#               (bitmask of the failing cases, bit case - 1) next to deny_case
+def process_database(mode="engine", input_path=INPUT_PATH, output_path=OUTPUT_PATH, profiler=None,
+                     chunk_rows=None, checkpoint_rows=None, resume=False, workers=None, all_rules=False,
+                     **params):
+
+    # mode == "chunked" -> engine replay out of core: external sort, chunks scored in order and results appended
+    #                      to the output as they are scored (no snapshot of the result spreadsheet)
+    if mode == "chunked":
+        from src.chunked import CHECKPOINT_ROWS, CHUNK_ROWS, replay_chunked
+        replay_chunked(input_path, output_path, chunk_rows or CHUNK_ROWS, profiler=profiler,
+                       checkpoint_rows=checkpoint_rows or CHECKPOINT_ROWS, resume=resume, all_rules=all_rules,
+                       **params)
+        if profiler is not None:
+            print(profiler.report())
+        return
+
+    df = read_input(input_path)
+    metrics = DecisionMetrics()
+    progress = ProgressReport()
+
+    # mode == "engine"     -> per-entity state, each transaction is scored without rescanning the history
+    # mode == "dataframe"  -> analyzes_transaction over the full history DataFrame
+    # mode == "lazy"       -> same, with history views sliced on demand and the cheapest rules first
+    # mode == "vectorized" -> all transactions scored at once with rolling windows (no loop per transaction)
+    # mode == "parallel"   -> engine replay of time segments in separate processes (see src.parallel)
+    if mode == "engine":
+        historical = replay_engine(df, profiler=profiler, metrics=metrics, progress=progress, all_rules=all_rules,
+                                   **params)
+    elif mode == "parallel":
+        from src.parallel import replay_parallel
+        historical, metrics = replay_parallel(df, workers=workers, profiler=profiler, progress=progress,
+                                              all_rules=all_rules, **params)
+    elif mode == "dataframe":
+        historical = replay_dataframe(df, profiler=profiler, progress=progress, all_rules=all_rules, **params)
+    elif mode == "lazy":
+        historical = replay_dataframe(df, profiler=profiler, progress=progress, lazy=True, all_rules=all_rules,
+                                      **params)
+    elif mode == "vectorized":
+        from src.backtest import replay_vectorized
+        historical = replay_vectorized(df, all_rules=all_rules, **params)
+    else:
+        raise ValueError(f"Unknown mode: {mode}")
+
+    if mode != "vectorized":
+        progress.finish()
+
+    # Decision metrics for the reports (the other modes don't keep them while deciding)
+    if mode not in ("engine", "parallel"):
+        metrics = DecisionMetrics.from_frame(historical)
+    metrics.save(metrics_path(output_path))
+
+    # Save the historical, as a columnar store when output_path is one (partitions by day, see src.store)
+    if is_store(output_path):
+        write_store(historical, output_path)
+    else:
+        historical.to_csv(output_path, index=False, encoding="utf-8")
+
+        # Binary snapshot of the historical for fast scoring start (see src.snapshot)
+        from src.snapshot import write_snapshot
+        write_snapshot(historical, output_path)
+
+    if profiler is not None:
+        print(profiler.report())
+
+###################################################################################################################
+
+# progress  -> optional ProgressReport, told about the scored transactions every PROGRESS_STEP of them
+# all_rules -> also record the bitmask of all the failing cases (fired_rules column)
+def replay_dataframe(df, profiler=None, progress=None, all_rules=False, **params):
+
+    # History with the results (rows are appended in place, the rules read it as a DataFrame view)
+    dtypes = {**df.dtypes.to_dict(), "recommendation": np.dtype(object), "deny_case": np.dtype(np.int64)}
+    if all_rules:
+        dtypes["fired_rules"] = np.dtype(np.int32)
+    historical = HistoryBuffer(dtypes, capacity=len(df))
+
+    for i, transaction in enumerate(df.to_dict("records")):
 
         # Classifies a transaction based on history
-        status = analyzes_transaction(transaction, historical)
+        status = analyzes_transaction(transaction, historical.frame(), profiler=profiler, all_rules=all_rules,
+                                      **params)
+
+        if all_rules:
+            transaction["fired_rules"] = status
+            status = first_case(status)
 
         # status == 0 -> transaction approved
         # status != 0 -> in some cases the transaction was declined
@@ -329,15 +659,80 @@ def process_database():
         else:
             recommendation = "approve"
 
-        print(f"id: {i}\nrecommendation: {recommendation}")
-
         # Add columns to help with analysis
         transaction["recommendation"] = recommendation
         transaction["deny_case"] = status
 
         # Add the transaction to the history
-        historical = pd.concat([historical, pd.DataFrame([transaction.copy()])], ignore_index=True)
+        historical.append(transaction)
 
-    # Save the historical
-    historical.to_csv(OUTPUT_PATH, index=False, encoding="utf-8")
+        if progress is not None and (i + 1) % PROGRESS_STEP == 0:
+            progress.add(PROGRESS_STEP)
+
+    if progress is not None:
+        progress.add(len(df) % PROGRESS_STEP)
+
+    return historical.frame()
+
+###################################################################################################################
 
+# engine  -> continues the replay of an engine that already holds the previous transactions (see src.chunked)
+# metrics -> optional src.metrics.DecisionMetrics, updated with each decision
+# progress, all_rules -> see replay_dataframe
+def replay_engine(df, profiler=None, engine=None, metrics=None, progress=None, all_rules=False, **params):
+
+    # Imported here because the engine reuses the constants of this module
+    from src.engine import ScoringEngine, paused_gc
+
+    if engine is None:
+        # The engine only keeps the transactions its windows can still reach (the results keep all of them)
+        engine = ScoringEngine(**params).retain()
+        engine.profiler = profiler
+        engine.metrics = metrics
+
+    recommendations = []
+    deny_cases = []
+    fired_rules = []
+
+    # Typed columns with encoded components instead of a dict per row
+    # The codes of the entities evicted meanwhile (see ScoringEngine.retain) are only released once all are scored
+    engine.hold_codes()
+    columns = engine.columns(df)
+
+    with paused_gc():
+        for i, (date, amount, user, card, device, merchant, has_cbk) in enumerate(columns.rows()):
+
+            # Classifies a transaction based on history and adds it to the history
+            if all_rules:
+                fired = engine.process_mask(date, amount, user, card, device, merchant, has_cbk)
+                fired_rules.append(fired)
+                status = first_case(fired)
+            else:
+                status = engine.process_codes(date, amount, user, card, device, merchant, has_cbk)
+
+            # status == 0 -> transaction approved
+            # status != 0 -> in some cases the transaction was declined
+            if status != 0:
+                recommendation = "deny"
+            else:
+                recommendation = "approve"
+
+            recommendations.append(recommendation)
+            deny_cases.append(status)
+
+            if progress is not None and (i + 1) % PROGRESS_STEP == 0:
+                progress.add(PROGRESS_STEP)
+
+    engine.release_codes()
+
+    if progress is not None:
+        progress.add(len(df) % PROGRESS_STEP)
+
+    # Add columns to help with analysis
+    historical = df.copy()
+    historical["recommendation"] = recommendations
+    historical["deny_case"] = deny_cases
+    if all_rules:
+        historical["fired_rules"] = np.array(fired_rules, dtype=np.int32)
+
+    return historical
@@ -0,0 +1,328 @@
+import numpy as np
+import pandas as pd
+
+from src.antifraud import CBK_DELAY_DAYS
+from src.engine import HOUR_NS
+
+# Date of a first CBK that never happened
+NEVER = np.iinfo(np.int64).max
+
+###################################################################################################################
+# Transactions of each User, Card, Device or Merchant in one sorted array
+# Rows are ordered by (entity, processing order), so the history of an entity is a contiguous slice and a time
+# window inside it is found with a single searchsorted over (entity, date rank) keys
+
+class EntityIndex:
+
+    def __init__(self, codes, dates):
+
+        n = len(dates)
+        self.dates = dates
+        self.scale = n + 1
+
+        # Rows with the component (codes == -1 means missing, e.g. a blank device_id)
+        rows = np.flatnonzero(codes >= 0)
+        self.order = rows[np.argsort(codes[rows], kind="stable")]
+        self.codes = codes[self.order].astype(np.int64)
+        self.position = np.arange(len(self.order))
+
+        self.base = self.codes * self.scale
+        self.keys = self.base + np.searchsorted(dates, dates, "left")[self.order]
+        self.row_keys = self.base + self.order
+        self.start = np.searchsorted(self.keys, self.base, "left")
+
+    # Results below are indexed by sorted position; queries come in sorted order, which keeps searchsorted fast
+
+    def search(self, ranks, base=None):
+        return np.searchsorted(self.keys, (self.base if base is None else base) + ranks, "left")
+
+    # Sorted index of the first transaction of the same entity at or after each row's date
+    def since(self, dates):
+        return self.search(np.searchsorted(self.dates, dates, "left")[self.order])
+
+    # Sorted index after the last previous transaction of the same entity at or before each row's date
+    def until(self, dates):
+        return np.minimum(self.search(np.searchsorted(self.dates, dates, "right")[self.order]), self.position)
+
+    def sorted(self, values):
+        return values[self.order]
+
+    # Back to one value per transaction (default for rows without the component)
+    def expand(self, values, default):
+        result = np.full(len(self.dates), default, dtype=np.asarray(values).dtype)
+        result[self.order] = values
+        return result
+
+###################################################################################################################
+# First transaction with CBK of each component (row and date)
+
+def first_cbks(codes, cbks, dates, size):
+
+    first_row = np.full(size, len(dates), dtype=np.int64)
+    cbk_rows = np.flatnonzero(cbks & (codes >= 0))
+    found, first = np.unique(codes[cbk_rows], return_index=True)
+    first_row[found] = cbk_rows[first]
+
+    first_date = np.full(size, NEVER, dtype=np.int64)
+    first_date[found] = dates[first_row[found]]
+
+    return first_row, first_date
+
+###################################################################################################################
+# Case 1: totals of the amount window [lo, position) of each entity, summed like pandas' Series.sum
+
+def window_totals(index, amounts, lo):
+
+    values = index.sorted(amounts)
+    count = index.position - lo
+    total = pairwise_sums(values, lo, count)
+
+    return np.where(count > 0, total + values, 0)
+
+# Sums of values[start:start + count] for all the rows at once, adding in numpy's order (pairwise summation) so
+# the totals are the same to the last bit as np.add.reduce of each slice
+def pairwise_sums(values, starts, counts):
+
+    total = np.zeros(len(starts))
+
+    # Fewer than 8 values are added from left to right
+    small = np.flatnonzero((counts > 0) & (counts < 8))
+    for k in range(7):
+        rows = small[counts[small] > k]
+        if k == 0:
+            total[rows] = values[starts[rows]]
+        else:
+            total[rows] += values[starts[rows] + k]
+
+    # Up to 128 values: 8 partial sums over blocks of 8 values, combined in pairs, then the values left
+    rows = np.flatnonzero((counts >= 8) & (counts <= 128))
+    if len(rows):
+        start, count = starts[rows], counts[rows]
+        blocks = count - count % 8
+        lane = np.arange(8)
+
+        partial = values[start[:, None] + lane]
+        for offset in range(8, int(blocks.max()), 8):
+            more = np.flatnonzero(blocks > offset)
+            partial[more] += values[start[more, None] + offset + lane]
+
+        sums = (((partial[:, 0] + partial[:, 1]) + (partial[:, 2] + partial[:, 3]))
+                + ((partial[:, 4] + partial[:, 5]) + (partial[:, 6] + partial[:, 7])))
+        for k in range(7):
+            more = np.flatnonzero(count % 8 > k)
+            sums[more] += values[start[more] + blocks[more] + k]
+
+        total[rows] = sums
+
+    # Up to 256 values: the two halves (the first one a multiple of 8) are summed separately
+    rows = np.flatnonzero((counts > 128) & (counts <= 256))
+    if len(rows):
+        half = counts[rows] // 2
+        half -= half % 8
+        total[rows] = (pairwise_sums(values, starts[rows], half)
+                       + pairwise_sums(values, starts[rows] + half, counts[rows] - half))
+
+    # Longer windows are summed one by one, gathering them costs more than the loop (the sum itself dominates)
+    for row in np.flatnonzero(counts > 256):
+        total[row] = np.add.reduce(values[starts[row]:starts[row] + counts[row]])
+
+    return total
+
+###################################################################################################################
+# Cases 12 - 17: distinct components (and components with a matured CBK) in the recent window of each entity
+# Each transaction j counts for the windows where it is the first occurrence of its component, which is a
+# contiguous range of rows because window starts only move forward; ranges are added with a difference array
+
+def rotation(index, component_codes, first_row, first_date, missing_row, missing_date, lo, cutoffs, delay,
+             max_components, inclusive):
+
+    m = len(index.order)
+    values = index.sorted(component_codes)
+
+    # Previous occurrence of the same component in the same entity
+    previous = np.full(m, -1, dtype=np.int64)
+    valid = np.flatnonzero(values >= 0)
+    same = valid[np.lexsort((valid, values[valid], index.codes[valid]))]
+    repeated = (index.codes[same[1:]] == index.codes[same[:-1]]) & (values[same[1:]] == values[same[:-1]])
+    previous[same[1:][repeated]] = same[:-1][repeated]
+
+    # Window starts only move forward along the sorted positions
+    first = np.maximum(valid + 1, np.searchsorted(lo, previous[valid] + 1, "left"))
+    last = np.searchsorted(lo, valid, "right")
+
+    # First window where the component has a matured CBK (its first CBK is before the cutoff and the row)
+    never = first_date[values[valid]] == NEVER
+    base = index.codes[valid] * index.scale
+    matured_date = np.where(never, 0, first_date[values[valid]]) + delay
+    matured = np.maximum(index.search(np.searchsorted(index.dates, matured_date, "left"), base),
+                         np.searchsorted(index.row_keys, base + first_row[values[valid]] + 1, "left"))
+    matured = np.where(never, m, np.maximum(matured, first))
+
+    distinct = range_counts(first, last, m)
+    distinct_cbk = range_counts(matured, last, m)
+
+    #-------------------------------------------------------------------------------------------------------------#
+    # Current transaction
+
+    position = index.position
+    rows = index.order
+    member = (values >= 0) & (previous >= lo)
+
+    own_row = np.where(values >= 0, first_row[np.maximum(values, 0)], missing_row)
+    own_date = np.where(values >= 0, first_date[np.maximum(values, 0)], missing_date)
+    own_cbk = (own_date <= cutoffs[rows]) & (own_row < rows)
+
+    total_components = distinct + ~member
+    cbk_components = distinct_cbk + (own_cbk & ~member)
+
+    if inclusive:
+        many_components = total_components >= max_components
+    else:
+        many_components = total_components > max_components
+
+    has_history = (position - index.start > 0) & (position - lo > 0)
+    deny = has_history & (many_components | (cbk_components >= 2))
+
+    return index.expand(deny, False)
+
+def range_counts(first, last, size):
+
+    keep = first < last
+    diff = np.bincount(first[keep], minlength=size + 1) - np.bincount(last[keep], minlength=size + 1)
+
+    return np.cumsum(diff[:size])
+
+###################################################################################################################
+# Scores every transaction of a sorted DataFrame at once (each one against all the previous rows)
+# Same decisions as replaying analyzes_transaction row by row, without a Python loop over the transactions
+# all_rules -> returns (deny_case, fired_rules), fired_rules being the bitmask of all the failing cases (bit case - 1)
+
+def score_frame(df, amount_limit=1000, time_window_hours=4, high_value=3500, start_period=21, end_period=4,
+                hours=24, limit=3, cbk_recent_days=7, cbk_limit=5, rotation_days=7, max_components=2,
+                cbk_delay_days=CBK_DELAY_DAYS, all_rules=False):
+
+    n = len(df)
+    if n == 0:
+        deny_case = np.zeros(0, dtype=np.int64)
+        return (deny_case, np.zeros(0, dtype=np.int32)) if all_rules else deny_case
+
+    dates = df["transaction_date"].to_numpy("datetime64[ns]").astype(np.int64)
+    amounts = df["transaction_amount"].to_numpy(np.float64)
+    cbks = df["has_cbk"].to_numpy(bool)
+
+    if np.any(dates[1:] < dates[:-1]):
+        raise ValueError("Transactions must be sorted by transaction_date")
+
+    delay = pd.Timedelta(days=cbk_delay_days).value
+    cutoffs = dates - delay
+
+    codes = {component: pd.factorize(df[column])[0]
+             for component, column in (("user", "user_id"), ("card", "card_number"),
+                                       ("device", "device_id"), ("merchant", "merchant_id"))}
+    indexes = {component: EntityIndex(component_codes, dates) for component, component_codes in codes.items()}
+
+    deny = {}
+
+    #=============================================================================================================#
+    # Case 1: two or more transactions that exceed the value limit in a period
+
+    amount_start = dates - pd.Timedelta(hours=time_window_hours).value
+    deny[1] = np.zeros(n, dtype=bool)
+    for component in ("user", "card", "device"):
+        index = indexes[component]
+        totals = window_totals(index, amounts, index.since(amount_start))
+        # Components without transactions in the window (or without device) keep a total of 0
+        deny[1] |= index.expand(totals, 0.0) > amount_limit
+
+    #---------------------------------------------------------------------------------------------------------#
+    # Case 2: High value for the period
+
+    hour = (dates // HOUR_NS) % 24
+    deny[2] = (amounts >= high_value) & ((hour >= start_period) | (hour <= end_period))
+
+    #---------------------------------------------------------------------------------------------------------#
+    # Cases 3 - 5: User, Card or Device made many transactions in a period
+
+    transactions_start = dates - pd.Timedelta(hours=hours).value
+    for case, component in ((3, "user"), (4, "card"), (5, "device")):
+        index = indexes[component]
+        count = np.maximum(index.position - index.since(transactions_start), 0)
+        deny[case] = index.expand((index.position > index.start) & (count >= limit), False)
+
+    #---------------------------------------------------------------------------------------------------------#
+    # Cases 6 - 11 and 18: CBKs known at the cutoff (transactions with more than CBK_DELAY_DAYS)
+
+    cbk_start = dates - pd.Timedelta(days=cbk_recent_days).value
+    for recent_case, global_case, component in ((6, 9, "user"), (7, 10, "card"), (8, 11, "device"),
+                                                (18, None, "merchant")):
+        index = indexes[component]
+        cumulative = np.concatenate(([0], np.cumsum(index.sorted(cbks))))
+
+        end = np.maximum(index.until(cutoffs), index.start)
+        recent_start = index.since(cbk_start)
+        has_matured = end > index.start
+
+        recent = np.where(recent_start < end, cumulative[end] - cumulative[np.minimum(recent_start, end)], 0)
+        deny[recent_case] = index.expand(has_matured & (recent > 1), False)
+
+        if global_case is not None:
+            total = cumulative[end] - cumulative[index.start]
+            deny[global_case] = index.expand(has_matured & (total > cbk_limit), False)
+
+    #---------------------------------------------------------------------------------------------------------#
+    # Cases 12 - 17: User, Card or Device with many components
+
+    sizes = {component: int(component_codes.max()) + 1 for component, component_codes in codes.items()}
+    firsts = {component: first_cbks(codes[component], cbks, dates, sizes[component])
+              for component in ("user", "card", "device")}
+
+    missing = np.flatnonzero(cbks & (codes["device"] < 0))
+    missing_row = missing[0] if len(missing) else n
+    missing_date = dates[missing_row] if len(missing) else NEVER
+
+    rotation_start = dates - pd.Timedelta(days=rotation_days).value
+    for case, main, component in ((12, "user", "card"), (13, "user", "device"), (14, "card", "device"),
+                                  (15, "card", "user"), (16, "device", "user"), (17, "device", "card")):
+        index = indexes[main]
+        # A card rotation is denied already at max_components, the others only above it
+        deny[case] = rotation(index, codes[component], *firsts[component], missing_row, missing_date,
+                              index.since(rotation_start), cutoffs, delay, max_components,
+                              component == "card")
+
+    #=============================================================================================================#
+    # First failing case in priority order (the first transaction has no history and is always approved)
+
+    deny_case = np.zeros(n, dtype=np.int64)
+    for case in range(18, 0, -1):
+        deny_case[deny[case]] = case
+
+    deny_case[:1] = 0
+
+    if not all_rules:
+        return deny_case
+
+    fired_rules = np.zeros(n, dtype=np.int32)
+    for case in range(1, 19):
+        fired_rules |= deny[case].astype(np.int32) << (case - 1)
+
+    fired_rules[:1] = 0
+
+    return deny_case, fired_rules
+
+###################################################################################################################
+
+def replay_vectorized(df, all_rules=False, **params):
+
+    if all_rules:
+        deny_case, fired_rules = score_frame(df, all_rules=True, **params)
+    else:
+        deny_case = score_frame(df, **params)
+
+    # Add columns to help with analysis
+    historical = df.copy()
+    historical["recommendation"] = np.where(deny_case != 0, "deny", "approve")
+    historical["deny_case"] = deny_case
+    if all_rules:
+        historical["fired_rules"] = fired_rules
+
+    return historical
@@ -0,0 +1,155 @@
+import copy
+import sys
+
+import numpy as np
+import pandas as pd
+
+from src.antifraud import OUTPUT_PATH
+from src.engine import MaturationQueue, ScoringEngine, paused_gc
+from src.snapshot import open_engine
+
+###################################################################################################################
+# Histories of an engine seen through a batch: a history is copied from the engine the first time the batch uses
+# it, so transactions added by the batch never reach the engine (same interface as the engine's dictionaries)
+
+class OverlayHistories:
+
+    def __init__(self, base):
+        self.base = base
+        self.local = {}
+
+    def get(self, key, default=None):
+
+        history = self.local.get(key)
+        if history is None:
+            history = self.base.get(key)
+            if history is None:
+                return default
+            history = self.local[key] = history.copy()
+
+        return history
+
+    def __getitem__(self, key):
+        history = self.get(key)
+        if history is None:
+            raise KeyError(key)
+        return history
+
+    def __setitem__(self, key, history):
+        self.local[key] = history
+
+# Encoder of an engine seen through a batch: the keys the engine does not know are encoded by it (its histories are
+# looked up by code) and their codes are handed back by release once the batch is over
+class OverlayEncoder:
+
+    def __init__(self, base):
+        self.base = base
+        self.added = []
+
+    def encode(self, key)-> int:
+        codes = self.base.codes
+        code = codes.get(key)
+        if code is None:
+            code = self.base.encode(key)
+            self.added.append(code)
+        return code
+
+    def decode(self, code):
+        return self.base.decode(code)
+
+    def encode_column(self, values)-> np.ndarray:
+        positions, uniques = pd.factorize(values)
+        codes = np.array([self.encode(key) for key in uniques.tolist()], dtype=np.int32)
+        return codes[positions]
+
+    # entities -> histories of the engine, a code it has a history for now (e.g. read from a snapshot) is kept
+    def release(self, entities):
+        for code in self.added:
+            if code not in entities:
+                self.base.release(code)
+        self.added = []
+
+# Engine that starts with the history of `engine` and keeps what is added to it to itself (see close_overlay)
+def overlay(engine)-> ScoringEngine:
+
+    batch = copy.copy(engine)
+    for name in ("users", "cards", "devices", "merchants"):
+        setattr(batch, name, OverlayHistories(getattr(engine, name)))
+    batch.encoders = {name: OverlayEncoder(encoder) for name, encoder in engine.encoders.items()}
+
+    batch.maturation = MaturationQueue(engine.cbk_delay, engine.cbk_window)
+    batch.rejected = {name: dict(codes) for name, codes in engine.rejected.items()}
+    batch.profiler = None
+    # The overlay is dropped after the batch, nothing to evict
+    batch.retention = None
+    batch.metrics = None
+    batch.checks = batch.security_checks()
+
+    return batch
+
+# Hands the codes of the keys only seen by the batch back to the engine
+def close_overlay(batch, engine):
+    for name, encoder in batch.encoders.items():
+        encoder.release(getattr(engine, name))
+
+###################################################################################################################
+# Scores many candidate transactions against the same history in one call
+# The candidates are encoded column by column and scored in time order through a copy-on-write overlay of the
+# engine (see overlay), which is left as it was: its histories, CBK counters, maturation clock and encoders
+
+# candidates  -> DataFrame or list of transactions (same columns as the input spreadsheet, has_cbk optional)
+# see_earlier -> each candidate also sees the candidates dated before it, as if they had been processed first
+#                (they are added to the overlay)
+# Returns the candidates with the recommendation and deny_case columns, in their original order
+def score_batch(engine, candidates, see_earlier=False)-> pd.DataFrame:
+
+    candidates = pd.DataFrame(candidates).reset_index(drop=True)
+    if "device_id" not in candidates:
+        candidates["device_id"] = np.nan
+    candidates["transaction_date"] = pd.to_datetime(candidates["transaction_date"])
+
+    scorer = overlay(engine)
+    columns = scorer.columns(candidates)
+
+    order = np.argsort(columns.dates, kind="stable")
+    deny_cases = np.zeros(len(candidates), dtype=np.int64)
+
+    dates = columns.dates[order].tolist()
+    amounts = columns.amounts[order].tolist()
+    users = columns.users[order].tolist()
+    cards = columns.cards[order].tolist()
+    devices = columns.devices[order].tolist()
+    merchants = columns.merchants[order].tolist()
+    has_cbk = columns.has_cbk[order].tolist()
+
+    try:
+        with paused_gc():
+            for i, row in enumerate(order.tolist()):
+                if see_earlier:
+                    status = scorer.process_codes(dates[i], amounts[i], users[i], cards[i], devices[i],
+                                                  merchants[i], has_cbk[i])
+                else:
+                    status = scorer.score_codes(dates[i], amounts[i], users[i], cards[i], devices[i], merchants[i])
+                deny_cases[row] = status
+    finally:
+        close_overlay(scorer, engine)
+
+    candidates["recommendation"] = np.where(deny_cases != 0, "deny", "approve").astype(object)
+    candidates["deny_case"] = deny_cases
+
+    return candidates
+
+###################################################################################################################
+# Pending transactions of a spreadsheet scored against the processed history (e.g. a settlement job)
+
+def score_spreadsheet(candidates_path, output_path, history_path=OUTPUT_PATH, see_earlier=False)-> pd.DataFrame:
+
+    candidates = pd.read_csv(candidates_path, parse_dates=["transaction_date"])
+    result = score_batch(open_engine(history_path), candidates, see_earlier)
+    result.to_csv(output_path, index=False, encoding="utf-8")
+
+    return result
+
+# python -m src.batch CANDIDATES.csv OUTPUT.csv [--see-earlier]
+if __name__ == "__main__":
+    score_spreadsheet(sys.argv[1], sys.argv[2], see_earlier="--see-earlier" in sys.argv[3:])
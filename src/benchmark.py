@@ -0,0 +1,183 @@
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.antifraud import analyzes_transaction, process_database
+from src.engine import ScoringEngine, transaction_fields
+from src.generator import generate_frame, write_transactions
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+BENCHMARK_PATH = "./data/benchmark.json"
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+DEFAULT_MODES = ("engine", "vectorized", "dataframe", "lazy")
+
+# analyzes_transaction rescans the whole history per transaction, larger replays take hours
+DATAFRAME_MAX_ROWS = 10_000
+
+LATENCY_SAMPLES = 1000
+DATAFRAME_LATENCY_SAMPLES = 100
+
+###################################################################################################################
+# Peak resident memory of the current process in MB (None where the resource module is not available)
+
+def peak_memory()-> float:
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+def percentiles(latencies)-> dict:
+
+    latencies = np.asarray(latencies) * 1000
+
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p90_ms": float(np.percentile(latencies, 90)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+    }
+
+###################################################################################################################
+# Replay throughput: process_database over a generated spreadsheet
+# Runs in a fresh process so the peak memory belongs to that replay only
+
+def _replay(mode, input_path, output_path)-> dict:
+
+    baseline = peak_memory()
+    start = time.perf_counter()
+
+    # The progress lines are not part of the measurement
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        process_database(mode, input_path=input_path, output_path=output_path)
+
+    seconds = time.perf_counter() - start
+    peak = peak_memory()
+
+    return {
+        "seconds": seconds,
+        "peak_memory_mb": peak,
+        "replay_memory_mb": None if peak is None else peak - baseline,
+    }
+
+def replay_throughput(mode, rows, input_path, workdir)-> dict:
+
+    context = multiprocessing.get_context("spawn")
+    output_path = os.path.join(workdir, f"result-{mode}-{rows}.csv")
+
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        measure = executor.submit(_replay, mode, input_path, output_path).result()
+
+    return {"benchmark": "process_database", "mode": mode, "rows": rows,
+            "transactions_per_second": rows / measure["seconds"], **measure}
+
+###################################################################################################################
+# Scoring latency of a single transaction against a history of `rows` transactions
+
+def engine_latency(history, candidates)-> dict:
+
+    engine = ScoringEngine().load(history)
+    latencies = []
+
+    for transaction in candidates:
+        fields = transaction_fields(transaction)
+        start = time.perf_counter()
+        engine.score_fields(*fields)
+        latencies.append(time.perf_counter() - start)
+
+    return {"benchmark": "latency", "scorer": "ScoringEngine.score", "rows": len(history),
+            "samples": len(latencies), **percentiles(latencies)}
+
+def dataframe_latency(history, candidates, lazy=False)-> dict:
+
+    latencies = []
+
+    for transaction in candidates:
+        start = time.perf_counter()
+        analyzes_transaction(transaction, history, lazy=lazy)
+        latencies.append(time.perf_counter() - start)
+
+    return {"benchmark": "latency", "scorer": "analyzes_transaction" + (" (lazy)" if lazy else ""),
+            "rows": len(history), "samples": len(latencies), **percentiles(latencies)}
+
+###################################################################################################################
+
+# sizes   -> numbers of generated transactions to benchmark
+# modes   -> process_database modes ("dataframe" and "lazy" only up to DATAFRAME_MAX_ROWS)
+# samples -> transactions timed one by one for the latency percentiles
+def benchmark(sizes=DEFAULT_SIZES, modes=DEFAULT_MODES, seed=0, samples=LATENCY_SAMPLES,
+              output_path=BENCHMARK_PATH)-> dict:
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for rows in sizes:
+
+            input_path = os.path.join(workdir, f"transactions-{rows}.csv")
+            write_transactions(input_path, rows, seed=seed)
+
+            for mode in modes:
+                if mode in ("dataframe", "lazy") and rows > DATAFRAME_MAX_ROWS:
+                    continue
+                results.append(replay_throughput(mode, rows, input_path, workdir))
+                print_result(results[-1])
+
+            # Candidates are generated after the history, with the same entities
+            transactions = generate_frame(rows + samples, seed=seed)
+            history = transactions.iloc[:rows]
+            candidates = transactions.iloc[rows:].to_dict("records")
+
+            results.append(engine_latency(history, candidates))
+            print_result(results[-1])
+
+            for lazy in (False, True):
+                results.append(dataframe_latency(history, candidates[:DATAFRAME_LATENCY_SAMPLES], lazy))
+                print_result(results[-1])
+
+    report = {
+        "seed": seed,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+
+    if output_path is not None:
+        with open(output_path, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+    return report
+
+def print_result(result):
+
+    if result["benchmark"] == "latency":
+        print(f"{result['scorer']:>28} | {result['rows']:>9} rows | p50 {result['p50_ms']:.3f} ms | "
+              f"p90 {result['p90_ms']:.3f} ms | p99 {result['p99_ms']:.3f} ms")
+    else:
+        memory = "n/a" if result["peak_memory_mb"] is None else f"{result['peak_memory_mb']:.0f} MB"
+        print(f"{result['mode']:>28} | {result['rows']:>9} rows | {result['seconds']:.2f} s | "
+              f"{result['transactions_per_second']:.0f} transactions/s | peak {memory}")
+
+###################################################################################################################
+
+# python -m src.benchmark [ROWS ...]
+if __name__ == "__main__":
+    sizes = tuple(int(rows) for rows in sys.argv[1:]) or DEFAULT_SIZES
+    benchmark(sizes)
@@ -0,0 +1,216 @@
+import copy
+import os
+import pickle
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from src.metrics import DecisionMetrics, metrics_path
+from src.store import append_store, is_store, open_store, source_fingerprint, truncate_store, write_store
+
+# Transactions read, sorted and replayed at a time
+CHUNK_ROWS = 100_000
+
+# Transactions between two checkpoints of the replay
+CHECKPOINT_ROWS = 500_000
+CHECKPOINT_VERSION = 1
+
+# Dates of the run files keep their microseconds whatever the rows of the chunk
+RUN_DATE_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+###################################################################################################################
+# Input transactions in processing order, a chunk at a time
+# The spreadsheet is sorted externally: each chunk is sorted and written to a run file, then the runs are merged,
+# so at most about chunk_rows transactions are in memory whatever the size of the input
+
+def normalize(chunk)-> pd.DataFrame:
+
+    # Same conversions as read_input
+    chunk["has_cbk"] = chunk["has_cbk"].astype(str).str.upper().map({"TRUE": True, "FALSE": False})
+    chunk["device_id"] = chunk["device_id"].replace("", np.nan).astype(np.float64)
+
+    return chunk
+
+def read_runs(runs, rows):
+
+    # Each run is read in blocks of its share of the chunk
+    readers = [pd.read_csv(run, parse_dates=["transaction_date"], date_format=RUN_DATE_FORMAT, chunksize=rows)
+               for run in runs]
+    buffers = [next(reader, None) for reader in readers]
+
+    while any(buffer is not None for buffer in buffers):
+
+        # Every run is sorted, so the transactions up to the smallest last date of the buffers can be emitted
+        bound = min(buffer["transaction_date"].iloc[-1] for buffer in buffers if buffer is not None)
+        parts = []
+
+        for i, buffer in enumerate(buffers):
+            if buffer is None:
+                continue
+            end = buffer["transaction_date"].searchsorted(bound, side="right")
+            parts.append(buffer.iloc[:end])
+            buffers[i] = buffer.iloc[end:] if end < len(buffer) else next(readers[i], None)
+
+        # Stable, ties keep the order of the input
+        chunk = pd.concat(parts, ignore_index=True)
+        yield chunk.sort_values(by="transaction_date", kind="stable").reset_index(drop=True)
+
+def sorted_chunks(input_path, chunk_rows=CHUNK_ROWS):
+
+    # A columnar store is already partitioned and sorted by day
+    if is_store(input_path):
+        store = open_store(input_path)
+        for day in store.days:
+            yield store.read(start=day, end=pd.Timestamp(day) + pd.Timedelta(days=1))
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+
+        runs = []
+        for chunk in pd.read_csv(input_path, parse_dates=["transaction_date"], chunksize=chunk_rows):
+            runs.append(os.path.join(workdir, f"run-{len(runs)}.csv"))
+            chunk = normalize(chunk).sort_values(by="transaction_date", kind="stable")
+            chunk.to_csv(runs[-1], index=False, date_format=RUN_DATE_FORMAT)
+
+        yield from read_runs(runs, max(1, chunk_rows // max(1, len(runs))))
+
+###################################################################################################################
+# Checkpoints of a replay: the engine (with its metrics), the transactions already replayed and the size of the
+# output they were written to, saved atomically every checkpoint_rows transactions so an interrupted replay
+# continues from the last one (resume=True) instead of starting over
+
+def checkpoint_path(output_path)-> str:
+    return output_path.rstrip(os.sep) + ".checkpoint"
+
+def output_state(output_path):
+    # Bytes of the spreadsheet, or the partitions of the store
+    if is_store(output_path):
+        return copy.deepcopy(open_store(output_path).meta["partitions"])
+    return os.path.getsize(output_path)
+
+def restore_output(output_path, state):
+    if is_store(output_path):
+        truncate_store(output_path, state)
+    else:
+        with open(output_path, "r+b") as file:
+            file.truncate(state)
+
+def write_checkpoint(path, checkpoint):
+
+    # Replaced atomically, an interruption while saving keeps the previous checkpoint
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as file:
+        pickle.dump(checkpoint, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+
+# Checkpoint of the same input and parameters, or None when there is none
+def read_checkpoint(path, source, settings):
+
+    try:
+        with open(path, "rb") as file:
+            checkpoint = pickle.load(file)
+    except FileNotFoundError:
+        return None
+
+    if checkpoint["version"] != CHECKPOINT_VERSION:
+        raise ValueError(f"Checkpoint {path} was written by another version")
+    if checkpoint["source"] != source:
+        raise ValueError(f"Input changed since the checkpoint {path} was written")
+    if checkpoint["settings"] != settings:
+        raise ValueError(f"Checkpoint {path} was written with other parameters: {checkpoint['settings']}")
+
+    return checkpoint
+
+# Chunks after the first rows transactions
+def skip_rows(chunks, rows):
+    for chunk in chunks:
+        if rows >= len(chunk):
+            rows -= len(chunk)
+            continue
+        yield chunk.iloc[rows:].reset_index(drop=True) if rows else chunk
+        rows = 0
+
+###################################################################################################################
+# Out-of-core replay: chunks are scored in order by one engine that only keeps the transactions its windows can
+# still reach, and the results are appended to the output about chunk_rows at a time
+
+# checkpoint_rows -> transactions between two checkpoints (rounded up to the written batches)
+# resume          -> continue from the checkpoint of output_path, if there is one
+# all_rules       -> also the fired_rules column (see src.antifraud.replay_engine)
+def replay_chunked(input_path, output_path, chunk_rows=CHUNK_ROWS, profiler=None, checkpoint_rows=CHECKPOINT_ROWS,
+                   resume=False, all_rules=False, **params):
+
+    # Imported here because the engine reuses the constants of src.antifraud
+    from src.antifraud import ProgressReport, replay_engine
+    from src.engine import ScoringEngine
+
+    path = checkpoint_path(output_path)
+    source = source_fingerprint(input_path)
+    # The external sort splits the input by chunk_rows, the same chunks give the same order
+    settings = {"chunk_rows": chunk_rows, "all_rules": all_rules, **params}
+
+    checkpoint = read_checkpoint(path, source, settings) if resume else None
+
+    if checkpoint is None:
+        # Only the transactions its windows can still reach are kept (evicting scans every entity, so once per
+        # chunk_rows)
+        engine = ScoringEngine(**params).retain(chunk_rows)
+        engine.metrics = DecisionMetrics()
+        done = 0
+    else:
+        engine = checkpoint["engine"]
+        done = checkpoint["rows"]
+        restore_output(output_path, checkpoint["output"])
+        print(f"Resuming after {done} transactions")
+
+    engine.profiler = profiler
+    progress = ProgressReport(done)
+    first = checkpoint is None
+    # Scored results not written yet, and transactions written since the last checkpoint
+    buffered = []
+    since_checkpoint = 0
+
+    def flush():
+        nonlocal first, since_checkpoint, done
+
+        historical = pd.concat(buffered, ignore_index=True) if len(buffered) > 1 else buffered[0]
+        buffered.clear()
+
+        if is_store(output_path):
+            (write_store if first else append_store)(historical, output_path)
+        else:
+            historical.to_csv(output_path, mode="w" if first else "a", header=first, index=False, encoding="utf-8")
+        first = False
+
+        # Saved with each write, the metrics always describe the results written so far
+        engine.metrics.save(metrics_path(output_path))
+
+        done += len(historical)
+        since_checkpoint += len(historical)
+        if since_checkpoint >= checkpoint_rows:
+            write_checkpoint(path, {"version": CHECKPOINT_VERSION, "source": source, "settings": settings,
+                                    "rows": done, "output": output_state(output_path), "engine": engine})
+            since_checkpoint = 0
+
+    pending = 0
+    for chunk in skip_rows(sorted_chunks(input_path, chunk_rows), done):
+
+        if chunk.empty:
+            continue
+
+        buffered.append(replay_engine(chunk, engine=engine, progress=progress, all_rules=all_rules))
+        pending += len(chunk)
+
+        if pending >= chunk_rows:
+            flush()
+            pending = 0
+
+    if buffered:
+        flush()
+
+    progress.finish()
+
+    # Finished, nothing left to resume
+    if os.path.exists(path):
+        os.remove(path)
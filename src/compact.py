@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+# Code of a transaction without device
+MISSING = -1
+
+MICROSECOND = pd.Timedelta(microseconds=1)
+
+###################################################################################################################
+# Compact typed representation of the transactions used by the engine
+# Timestamps are int64 epoch microseconds (the precision of the spreadsheet) and User, Card, Device and Merchant
+# keys are dictionary-encoded to int32 codes, so histories hold machine numbers instead of Python objects
+
+# Timedelta (or keyword arguments of pd.Timedelta) in microseconds
+def micros(delta=None, **parts)-> int:
+    return (pd.Timedelta(**parts) if delta is None else pd.Timedelta(delta)) // MICROSECOND
+
+# Epoch microseconds of a column of dates
+def date_micros(dates)-> np.ndarray:
+    return pd.to_datetime(dates).to_numpy("datetime64[us]").astype(np.int64)
+
+###################################################################################################################
+# Dictionary encoding: each distinct key gets the next int32 code
+
+class Encoder:
+
+    __slots__ = ("codes", "keys", "free")
+
+    def __init__(self):
+        self.codes = {}
+        self.keys = []
+        # Codes released by evicted entities, reused before new ones
+        self.free = []
+
+    def __len__(self)-> int:
+        return len(self.codes)
+
+    def encode(self, key)-> int:
+        code = self.codes.get(key)
+        if code is None:
+            if self.free:
+                code = self.free.pop()
+                self.keys[code] = key
+            else:
+                code = len(self.keys)
+                self.keys.append(key)
+            self.codes[key] = code
+        return code
+
+    # The key is no longer referenced by the engine (its code can be given to another key)
+    def release(self, code):
+        del self.codes[self.keys[code]]
+        self.keys[code] = None
+        self.free.append(code)
+
+    def decode(self, code):
+        return self.keys[code]
+
+    # Codes of a whole column (each distinct key is looked up once)
+    def encode_column(self, values)-> np.ndarray:
+        positions, uniques = pd.factorize(values)
+        codes = np.array([self.encode(key) for key in uniques.tolist()], dtype=np.int32)
+        return codes[positions]
+
+###################################################################################################################
+# Array-backed columns of a transactions DataFrame, encoded with the engine's encoders
+
+class TransactionColumns:
+
+    __slots__ = ("dates", "amounts", "users", "cards", "devices", "merchants", "has_cbk")
+
+    def __init__(self, df, encoders):
+
+        self.dates = date_micros(df["transaction_date"])
+        self.amounts = df["transaction_amount"].to_numpy(np.float64)
+        self.users = encoders["users"].encode_column(df["user_id"].astype(np.int64).to_numpy())
+        self.cards = encoders["cards"].encode_column(df["card_number"].astype(str).to_numpy())
+        self.merchants = encoders["merchants"].encode_column(df["merchant_id"].astype(np.int64).to_numpy())
+
+        devices = df["device_id"].to_numpy(np.float64)
+        has_device = ~np.isnan(devices)
+        self.devices = np.full(len(df), MISSING, dtype=np.int32)
+        self.devices[has_device] = encoders["devices"].encode_column(devices[has_device].astype(np.int64))
+
+        # Transactions still being decided have no CBK label
+        self.has_cbk = df["has_cbk"].to_numpy(bool) if "has_cbk" in df else np.zeros(len(df), dtype=bool)
+
+    def __len__(self)-> int:
+        return len(self.dates)
+
+    # (date, amount, user, card, device, merchant, has_cbk) of each row as Python scalars
+    def rows(self):
+        return zip(self.dates.tolist(), self.amounts.tolist(), self.users.tolist(), self.cards.tolist(),
+                   self.devices.tolist(), self.merchants.tolist(), self.has_cbk.tolist())
@@ -0,0 +1,1023 @@
+import contextlib
+import gc
+import heapq
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+
+import numpy as np
+import pandas as pd
+
+from src.antifraud import CBK_DELAY_DAYS, first_case
+from src.compact import MISSING, Encoder, TransactionColumns, date_micros, micros
+from src.profiling import SLICING
+
+HOUR_NS = pd.Timedelta(hours=1).value
+HOUR_US = micros(hours=1)
+
+# Rotation windows from this many transactions on are answered by the entity's LinkIndex
+LINK_INDEX_ROWS = 16
+
+# Transactions processed between two evictions of the retention policy (see ScoringEngine.retain)
+RETENTION_ROWS = 100_000
+# How late a transaction may reach a resident scorer (service, stream) and still see its full windows
+RETENTION_LATE_HOURS = 24
+# How long a resident scorer remembers a forgotten user to tell its next transaction is not its first (metrics)
+RETENTION_USER_DAYS = 365
+
+# Case of the all-time CBK count of each component (see ScoringEngine.rejected)
+GLOBAL_CBK_CASES = {9: "users", 10: "cards", 11: "devices"}
+
+###################################################################################################################
+# Sum of amounts with the same association order as numpy's add.reduce (used by pandas' Series.sum)
+# A running total would drift from the DataFrame rule right at the amount_limit boundary
+
+def amount_sum(amounts)-> float:
+
+    # numpy only switches to pairwise summation from 8 values on
+    if len(amounts) >= 8:
+        return float(np.add.reduce(np.asarray(amounts, dtype=np.float64)))
+
+    total = amounts[0]
+    for amount in amounts[1:]:
+        total += amount
+
+    return total
+
+###################################################################################################################
+# The engine state is acyclic (histories, link indexes and queue events), so while it grows the cyclic garbage
+# collector only rescans it over and over; bulk loads and replays run with the collector paused
+
+@contextlib.contextmanager
+def paused_gc():
+
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+###################################################################################################################
+# Distinct Users, Cards or Devices linked to one entity, with the date each one was last seen with it
+# Kept sorted by that date, the components seen in a window are the tail of the list (rotation cases 12 - 17)
+
+class LinkIndex:
+
+    __slots__ = ("last_seen", "order")
+
+    def __init__(self):
+        self.last_seen = {}
+        self.order = []
+
+    def add(self, component, date):
+
+        order = self.order
+        last = self.last_seen.get(component)
+
+        if last is not None:
+            if date <= last:
+                return
+            # Usually the component of the previous transaction
+            if order[-1] == (last, component):
+                order.pop()
+            else:
+                del order[bisect_left(order, (last, component))]
+
+        self.last_seen[component] = date
+
+        if not order or (date, component) > order[-1]:
+            order.append((date, component))
+        else:
+            insort(order, (date, component))
+
+    # Number of distinct components seen at or after start
+    def count(self, start)-> int:
+        return len(self.order) - bisect_left(self.order, (start,))
+
+    def seen(self, component, start)-> bool:
+        last = self.last_seen.get(component)
+        return last is not None and last >= start
+
+    # Components seen at or after start (most recent last)
+    def since(self, start):
+        for i in range(bisect_left(self.order, (start,)), len(self.order)):
+            yield self.order[i][1]
+
+    def copy(self)-> "LinkIndex":
+        index = LinkIndex()
+        index.last_seen = dict(self.last_seen)
+        index.order = list(self.order)
+        return index
+
+    # Forgets the components last seen before `before`
+    def evict(self, before):
+        k = bisect_left(self.order, (before,))
+        for _, component in self.order[:k]:
+            del self.last_seen[component]
+        del self.order[:k]
+
+###################################################################################################################
+# Time-ordered history of a single User, Card, Device or Merchant
+# Typed arrays: dates in epoch microseconds, amounts, and the codes of the linked components (MISSING device = -1)
+# Only the columns the rules read for that kind of entity are kept (see HISTORY_COLUMNS)
+
+# Components linked to each kind of entity and whether its amounts are kept
+HISTORY_COLUMNS = {
+    "users": (("cards", "devices"), True),
+    "cards": (("users", "devices"), True),
+    "devices": (("users", "cards"), True),
+    "merchants": ((), False),
+}
+
+class EntityHistory:
+
+    __slots__ = ("dates", "amounts", "cbk_dates", "first_date", "first_cbk", "folded_cbks", "users", "cards",
+                 "devices", "user_links", "card_links", "device_links", "tracked", "matured_cbks", "recent_cbks")
+
+    def __init__(self, components=("users", "cards", "devices"), amounts=True):
+        self.dates = array("q")
+        self.amounts = array("d") if amounts else None
+        self.first_date = None
+        self.first_cbk = None
+
+        # CBKs of older transactions that are only kept as aggregates (all of them before any rule window)
+        self.folded_cbks = 0
+
+        # Most entities never have a CBK, the array is created with the first one
+        self.cbk_dates = ()
+
+        # Components linked to each transaction (used by the rotation cases)
+        self.users = array("i") if "users" in components else None
+        self.cards = array("i") if "cards" in components else None
+        self.devices = array("i") if "devices" in components else None
+
+        # LinkIndex of each component, built on first use
+        self.user_links = None
+        self.card_links = None
+        self.device_links = None
+
+        # CBK counters kept by the engine's MaturationQueue (valid at its clock once tracked)
+        self.tracked = False
+        self.matured_cbks = 0
+        self.recent_cbks = 0
+
+    def add(self, date, amount, has_cbk, user, card, device):
+
+        if self.user_links is not None:
+            self.user_links.add(user, date)
+        if self.card_links is not None:
+            self.card_links.add(card, date)
+        if self.device_links is not None and device != MISSING:
+            self.device_links.add(device, date)
+
+        # Transactions normally arrive in time order, so this is an append
+        i = len(self.dates)
+        if i and date < self.dates[-1]:
+            i = bisect_right(self.dates, date)
+
+        self.dates.insert(i, date)
+        if i == 0 and (self.first_date is None or date < self.first_date):
+            self.first_date = date
+        for column, value in ((self.amounts, amount), (self.users, user), (self.cards, card),
+                              (self.devices, device)):
+            if column is not None:
+                column.insert(i, value)
+
+        if has_cbk:
+            if not self.cbk_dates:
+                self.cbk_dates = array("q")
+            insort(self.cbk_dates, date)
+            if self.first_cbk is None or date < self.first_cbk:
+                self.first_cbk = date
+
+    # Position of the first transaction at or after start
+    def since(self, start)-> int:
+        return bisect_left(self.dates, start)
+
+    # Number of CBKs between start and cutoff
+    def cbks(self, start, cutoff)-> int:
+        if start > cutoff:
+            return 0
+        return bisect_right(self.cbk_dates, cutoff) - bisect_left(self.cbk_dates, start)
+
+    # Independent copy, not tracked by any MaturationQueue yet
+    def copy(self)-> "EntityHistory":
+
+        history = EntityHistory.__new__(EntityHistory)
+        for name in EntityHistory.__slots__:
+            value = getattr(self, name)
+            if isinstance(value, (array, tuple)):
+                value = value[:]
+            elif isinstance(value, LinkIndex):
+                value = value.copy()
+            setattr(history, name, value)
+
+        history.tracked = False
+        history.matured_cbks = 0
+        history.recent_cbks = 0
+
+        return history
+
+    # Drops the transactions dated before `before`, their CBKs are kept as folded_cbks
+    def evict(self, before):
+
+        k = bisect_left(self.dates, before)
+        del self.dates[:k]
+        for column in (self.amounts, self.users, self.cards, self.devices):
+            if column is not None:
+                del column[:k]
+
+        k = bisect_left(self.cbk_dates, before)
+        if k:
+            self.folded_cbks += k
+            del self.cbk_dates[:k]
+
+        for index in (self.user_links, self.card_links, self.device_links):
+            if index is not None:
+                index.evict(before)
+
+    # Users, Cards or Devices linked to this entity (a missing device is not a linked component)
+    def linked(self, component)-> LinkIndex:
+
+        attribute = component[:-1] + "_links"
+        index = getattr(self, attribute)
+
+        if index is None:
+            index = LinkIndex()
+            for date, value in zip(self.dates, getattr(self, component)):
+                if value != MISSING:
+                    index.add(value, date)
+            setattr(self, attribute, index)
+
+        return index
+
+###################################################################################################################
+# Time-ordered queue of CBK events
+# A CBK becomes visible CBK_DELAY_DAYS after its transaction and leaves the recent window cbk_recent_days after it,
+# so while the scored transactions move forward in time the counters of cases 6 - 11 and 18 are updated by heap
+# pops instead of searching each history
+# At clock t: matured_cbks -> CBKs dated up to t - delay, recent_cbks -> CBKs dated between t - window and t - delay
+
+ENTER = 0
+LEAVE = 1
+
+class MaturationQueue:
+
+    def __init__(self, delay, window):
+        self.delay = delay
+        self.window = window
+        self.clock = None
+        self.events = []
+        self.sequence = 0
+
+    def push(self, key, kind, history):
+        heapq.heappush(self.events, (key, self.sequence, kind, history))
+        self.sequence += 1
+
+    # Moves the clock to date, False when date is before the clock (the counters can't go back)
+    def advance(self, date)-> bool:
+
+        if self.clock is not None and date < self.clock:
+            return False
+
+        self.clock = date
+        events = self.events
+
+        while events and events[0][0] <= date:
+            key, _, kind, history = heapq.heappop(events)
+            if kind == ENTER:
+                history.matured_cbks += 1
+                # Only counts as recent when it is still in the window after the delay
+                leave = key - self.delay + self.window + 1
+                if leave > key:
+                    history.recent_cbks += 1
+                    self.push(leave, LEAVE, history)
+            else:
+                history.recent_cbks -= 1
+
+        return True
+
+    # Starts keeping the counters of a history (built elsewhere, e.g. read from a snapshot)
+    def track(self, history):
+
+        history.tracked = True
+        history.matured_cbks = history.folded_cbks
+        history.recent_cbks = 0
+
+        for date in history.cbk_dates:
+            self.add(history, date)
+
+    # New CBK of a tracked history
+    def add(self, history, date):
+
+        clock = self.clock
+
+        if clock is None or date + self.delay > clock:
+            self.push(date + self.delay, ENTER, history)
+            return
+
+        # Already matured at the clock (transaction added out of order)
+        history.matured_cbks += 1
+        if clock - self.window <= date <= clock - self.delay:
+            history.recent_cbks += 1
+            self.push(date + self.window + 1, LEAVE, history)
+
+###################################################################################################################
+# Transaction being scored with its components already resolved to their histories
+
+class Candidate:
+
+    __slots__ = ("date", "amount", "user", "card", "device", "merchant", "cutoff", "current",
+                 "user_history", "card_history", "device_history", "merchant_history")
+
+###################################################################################################################
+# Stateful version of analyzes_transaction
+# Keeps per User, Card, Device and Merchant histories instead of filtering the whole DataFrame on every call,
+# returning the same deny_case codes (1 - 18) for the same history
+
+class ScoringEngine:
+
+    def __init__(self, amount_limit=1000, time_window_hours=4, high_value=3500, start_period=21, end_period=4,
+                 hours=24, limit=3, cbk_recent_days=7, cbk_limit=5, rotation_days=7, max_components=2,
+                 cbk_delay_days=CBK_DELAY_DAYS):
+
+        self.amount_limit = amount_limit
+        self.high_value = high_value
+        self.start_period = start_period
+        self.end_period = end_period
+        self.limit = limit
+        self.cbk_limit = cbk_limit
+        self.max_components = max_components
+
+        # Windows in microseconds, like the dates
+        self.amount_window = micros(hours=time_window_hours)
+        self.transactions_window = micros(hours=hours)
+        self.cbk_window = micros(days=cbk_recent_days)
+        self.rotation_window = micros(days=rotation_days)
+        self.cbk_delay = micros(days=cbk_delay_days)
+
+        # Histories by component code
+        self.users = {}
+        self.cards = {}
+        self.devices = {}
+        self.merchants = {}
+
+        # Codes of the user_id, card_number, device_id and merchant_id values
+        self.encoders = {"users": Encoder(), "cards": Encoder(), "devices": Encoder(), "merchants": Encoder()}
+
+        # First CBK of a transaction without device (a missing device also counts as a component)
+        self.missing_device_cbk = None
+        self.size = 0
+
+        # CBK counters of the histories, up to date for transactions scored in time order
+        self.maturation = MaturationQueue(self.cbk_delay, self.cbk_window)
+
+        # Optional src.profiling.RuleProfiler (history lookups and each rule are timed when set)
+        self.profiler = None
+
+        # Optional src.metrics.DecisionMetrics, updated with each processed transaction
+        self.metrics = None
+
+        # Codes of the Users, Cards and Devices known to exceed cbk_limit, with the date they were found to
+        # Their matured CBKs only grow, so cases 9 - 11 deny them at any later date (see fast_reject)
+        self.rejected = {"users": {}, "cards": {}, "devices": {}}
+
+        # Retention policy (see retain): transactions processed between evictions (None keeps all of them), how
+        # late a transaction may arrive and still be scored as with the full history, and the count since the last
+        self.retention = None
+        self.lateness = 0
+        self.unevicted = 0
+
+        # Keys of the users forgotten while there are metrics, with the date they were forgotten at, and how long
+        # they are remembered (None for as long as the engine runs)
+        self.forgotten_users = {}
+        self.user_memory = None
+
+        # Codes of forgotten entities kept from reuse while rows encoded ahead may still hold them (see hold_codes)
+        self.held = None
+
+        # Security cases in priority order
+        self.checks = self.security_checks()
+
+    # (case, check) of each security case, bound to this engine's histories
+    def security_checks(self)-> tuple:
+        return (
+            (1, self._exceeded_limit),
+            (2, self._too_late),
+            (3, lambda c: self._many_transactions(c.user_history, c)),
+            (4, lambda c: self._many_transactions(c.card_history, c)),
+            (5, lambda c: self._many_transactions(c.device_history, c)),
+            (6, lambda c: self._many_cbks(c.user_history, c)),
+            (7, lambda c: self._many_cbks(c.card_history, c)),
+            (8, lambda c: self._many_cbks(c.device_history, c)),
+            (9, lambda c: self._global_cbks(c.user_history, c)),
+            (10, lambda c: self._global_cbks(c.card_history, c)),
+            (11, lambda c: self._global_cbks(c.device_history, c)),
+            (12, lambda c: self._rotation(c.user_history, "cards", c.card, c)),
+            (13, lambda c: self._rotation(c.user_history, "devices", c.device, c)),
+            (14, lambda c: self._rotation(c.card_history, "devices", c.device, c)),
+            (15, lambda c: self._rotation(c.card_history, "users", c.user, c)),
+            (16, lambda c: self._rotation(c.device_history, "users", c.user, c)),
+            (17, lambda c: self._rotation(c.device_history, "cards", c.card, c)),
+            (18, lambda c: self._many_cbks(c.merchant_history, c)),
+        )
+
+    # Pickled without the bound checks and the profiler (see src.chunked checkpoints)
+    def __getstate__(self)-> dict:
+        state = self.__dict__.copy()
+        del state["checks"]
+        state["profiler"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.checks = self.security_checks()
+
+    #=============================================================================================================#
+    # State
+
+    def add(self, transaction):
+        # Unknown CBK means no CBK yet
+        self.add_fields(*transaction_fields(transaction), bool(cbk_label(transaction)))
+
+    # Values as returned by transaction_fields
+    def add_fields(self, date, amount, user, card, device, merchant, has_cbk):
+        self.add_codes(date, amount, *self.encode(user, card, device, merchant), has_cbk)
+
+    # Components already encoded (see encode)
+    def add_codes(self, date, amount, user, card, device, merchant, has_cbk):
+
+        for name, entities, key in (("users", self.users, user), ("cards", self.cards, card),
+                                    ("merchants", self.merchants, merchant), ("devices", self.devices, device)):
+
+            if key == MISSING:
+                continue
+
+            history = entities.get(key)
+            if history is None:
+                history = entities[key] = EntityHistory(*HISTORY_COLUMNS[name])
+                history.tracked = True
+            history.add(date, amount, has_cbk, user, card, device)
+
+            if has_cbk and history.tracked:
+                self.maturation.add(history, date)
+
+        if device == MISSING and has_cbk and (self.missing_device_cbk is None or date < self.missing_device_cbk):
+            self.missing_device_cbk = date
+
+        self.size += 1
+
+    # Loads a processed history (same columns as the input spreadsheet)
+    def load(self, history):
+
+        with paused_gc():
+            for row in self.columns(history).rows():
+                self.add_codes(*row)
+
+        return self
+
+    # User, Card, Device and Merchant codes (a missing device is MISSING)
+    def encode(self, user, card, device, merchant)-> tuple:
+        encoders = self.encoders
+        return (encoders["users"].encode(user), encoders["cards"].encode(card),
+                MISSING if device is None else encoders["devices"].encode(device),
+                encoders["merchants"].encode(merchant))
+
+    # Transactions DataFrame as encoded columns
+    def columns(self, df)-> TransactionColumns:
+        return TransactionColumns(df, self.encoders)
+
+    # Furthest any rule looks back from a transaction, older transactions only matter through their aggregates
+    def horizon(self)-> int:
+        return max(self.amount_window, self.transactions_window, self.cbk_window, self.rotation_window,
+                   self.cbk_delay)
+
+    # Starts the histories from the aggregates of the transactions before the loaded ones (see src.store)
+    # aggregates -> {"users" | "cards" | "devices" | "merchants": DataFrame of key, first_date, cbks, first_cbk}
+    def fold(self, aggregates, rows, missing_device_cbk=None):
+
+        for name, entities in (("users", self.users), ("cards", self.cards), ("merchants", self.merchants),
+                               ("devices", self.devices)):
+
+            folded = aggregates[name]
+            codes = self.encoders[name].encode_column(folded["key"].to_numpy())
+            first_dates = date_micros(folded["first_date"]).tolist()
+            first_cbks = date_micros(folded["first_cbk"]).tolist()
+
+            for code, first_date, cbks, first_cbk, has_cbk in zip(
+                    codes.tolist(), first_dates, folded["cbks"].tolist(), first_cbks,
+                    folded["first_cbk"].notna().tolist()):
+
+                history = entities[code] = EntityHistory(*HISTORY_COLUMNS[name])
+                history.first_date = first_date
+                history.folded_cbks = cbks
+                history.first_cbk = first_cbk if has_cbk else None
+                self.maturation.track(history)
+
+        if missing_device_cbk is not None:
+            self.missing_device_cbk = pd.Timestamp(missing_device_cbk).value // 1000
+
+        self.size += rows
+
+        return self
+
+    # Retention policy of a scorer: every `every` processed transactions, the ones older than horizon() (plus
+    # late_hours) before the latest scored transaction are evicted, so memory follows the transactions of the
+    # rule windows instead of growing with the uptime
+    # Transactions up to late_hours older than the latest one are still scored as with the full history
+    # user_days -> how long the metrics remember a forgotten user (None: always, the key of every user seen is kept)
+    def retain(self, every=RETENTION_ROWS, late_hours=0, user_days=None):
+
+        self.retention = every
+        self.lateness = micros(hours=late_hours)
+        self.unevicted = 0
+        self.user_memory = None if user_days is None else micros(days=user_days)
+
+        return self
+
+    def apply_retention(self):
+
+        self.unevicted += 1
+        if self.unevicted < self.retention or self.maturation.clock is None:
+            return
+
+        self.evict(self.maturation.clock - self.horizon() - self.lateness)
+        self.unevicted = 0
+
+    # Keeps only the transactions dated from `before` on, older CBKs become folded counts and the entities left
+    # with neither transactions nor CBKs are forgotten (with their codes)
+    # Scoring transactions dated from before + horizon() on gives the same results as with the full history
+    def evict(self, before):
+
+        for name, entities in (("users", self.users), ("cards", self.cards), ("merchants", self.merchants),
+                               ("devices", self.devices)):
+
+            # Every entity is kept with limit 0 (cases 3 - 5 then deny any entity seen before)
+            keep = self.limit == 0
+
+            forgotten = []
+            for code, history in entities.items():
+                if not history.dates or history.dates[0] >= before:
+                    continue
+                history.evict(before)
+                if not keep and not history.dates and history.first_cbk is None:
+                    forgotten.append(code)
+
+            encoder = self.encoders[name]
+
+            # The metrics only need to know a forgotten user was seen (its next transaction is not its first)
+            if name == "users" and self.metrics is not None:
+                for code in forgotten:
+                    self.forgotten_users[encoder.decode(code)] = before
+                if self.user_memory is not None:
+                    since = before - self.user_memory
+                    self.forgotten_users = {user: date for user, date in self.forgotten_users.items()
+                                            if date >= since}
+
+            for code in forgotten:
+                del entities[code]
+                if self.held is None:
+                    encoder.release(code)
+                else:
+                    self.held[name].add(code)
+
+    # While rows encoded ahead of scoring (see columns) are processed, evicting must not hand the codes of the
+    # forgotten entities to other keys: they are held until release_codes, called once those rows are done
+    def hold_codes(self):
+        if self.held is None:
+            self.held = {name: set() for name in self.encoders}
+
+    def release_codes(self):
+
+        held = self.held
+        self.held = None
+        if held is None:
+            return
+
+        for name, codes in held.items():
+            entities = getattr(self, name)
+            encoder = self.encoders[name]
+            for code in codes:
+                # Seen again after it was forgotten, the code is in use by a new history
+                if code not in entities:
+                    encoder.release(code)
+
+    #=============================================================================================================#
+    # Scoring
+
+    def score(self, transaction)-> int:
+        return self.score_fields(*transaction_fields(transaction))
+
+    # Values as returned by transaction_fields
+    def score_fields(self, date, amount, user, card, device, merchant)-> int:
+        return self.score_codes(date, amount, *self.encode(user, card, device, merchant))
+
+    def score_codes(self, date, amount, user, card, device, merchant)-> int:
+
+        if self.profiler is not None:
+            return self.profiled_score(date, amount, user, card, device, merchant)
+
+        if self.size == 0:
+            return 0
+
+        # Components known to exceed cbk_limit are decided without the full evaluation when possible
+        rejected = self.rejected
+        if rejected["users"] or rejected["cards"] or rejected["devices"]:
+            case = self.rejected_case(date, user, card, device)
+            if case:
+                status = self.fast_reject(date, amount, user, card, device, case)
+                if status:
+                    return status
+
+        c = self.candidate(date, amount, user, card, device, merchant)
+
+        for case, check in self.checks:
+            if not check(c):
+                if case in GLOBAL_CBK_CASES:
+                    self.reject(case, c)
+                return case
+
+        # Transaction approved
+        return 0
+
+    #=============================================================================================================#
+    # Fast rejection of components already over cbk_limit
+
+    # First of cases 9 - 11 already known to deny the transaction (0 if none), from the codes alone
+    def rejected_case(self, date, user, card, device)-> int:
+
+        rejected = self.rejected
+
+        since = rejected["users"].get(user)
+        if since is not None and since <= date:
+            return 9
+        since = rejected["cards"].get(card)
+        if since is not None and since <= date:
+            return 10
+        since = rejected["devices"].get(device)
+        if since is not None and since <= date:
+            return 11
+
+        return 0
+
+    def reject(self, case, c):
+
+        codes = self.rejected[GLOBAL_CBK_CASES[case]]
+        code = (c.user, c.card, c.device)[case - 9]
+
+        since = codes.get(code)
+        if since is None or c.date < since:
+            codes[code] = c.date
+
+    # Deny case of a transaction that case `rejected` denies, from the short forms of the cases before it: the
+    # amounts in the window of case 1, the last transactions of each history and the CBK counters (cases are
+    # numbered in priority order, so the smallest one that fires is the deny_case)
+    # 0 when the counters can't be used, the full evaluation decides then
+    def fast_reject(self, date, amount, user, card, device, rejected)-> int:
+
+        # The counters are behind the histories of a transaction scored out of order
+        if not self.maturation.advance(date):
+            return 0
+
+        amount_start = date - self.amount_window
+        transactions_start = date - self.transactions_window
+        cutoff = date - self.cbk_delay
+        limit = self.limit
+        status = rejected
+
+        for history, many_transactions, many_cbks, global_cbks in (
+                (self.users.get(user), 3, 6, 9), (self.cards.get(card), 4, 7, 10),
+                (None if device == MISSING else self.devices.get(device), 5, 8, 11)):
+
+            if history is None:
+                continue
+
+            if not history.tracked:
+                return 0
+
+            # Case 1 (same sum as _exceeded_limit)
+            dates = history.dates
+            if dates and dates[-1] >= amount_start:
+                if amount_sum(history.amounts[history.since(amount_start):]) + amount > self.amount_limit:
+                    return 1
+
+            if len(dates) >= limit and (limit == 0 or dates[-limit] >= transactions_start):
+                case = many_transactions
+            elif history.first_date <= cutoff and history.recent_cbks > 1:
+                case = many_cbks
+            elif history.first_date <= cutoff and history.matured_cbks > self.cbk_limit:
+                case = global_cbks
+            else:
+                continue
+
+            if case < status:
+                status = case
+
+        # Case 2
+        hour = (date // HOUR_US) % 24
+        if amount >= self.high_value and ((hour >= self.start_period) or (hour <= self.end_period)):
+            return 2
+
+        return status
+
+    # Same as score_codes, timing the history lookups and each rule
+    def profiled_score(self, date, amount, user, card, device, merchant)-> int:
+
+        profiler = self.profiler
+        profiler.transactions += 1
+
+        if self.size == 0:
+            return 0
+
+        start = time.perf_counter_ns()
+        c = self.candidate(date, amount, user, card, device, merchant)
+        profiler.record(SLICING, time.perf_counter_ns() - start)
+
+        for case, check in self.checks:
+            if not profiler.call(case, check, c):
+                return case
+
+        return 0
+
+    # Bitmask of every security case that denies the transaction (bit case - 1), evaluating all of them instead of
+    # stopping at the first one (first_case of the mask is the score_codes result)
+    def rule_mask(self, date, amount, user, card, device, merchant)-> int:
+
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.transactions += 1
+
+        if self.size == 0:
+            return 0
+
+        if profiler is None:
+            c = self.candidate(date, amount, user, card, device, merchant)
+        else:
+            start = time.perf_counter_ns()
+            c = self.candidate(date, amount, user, card, device, merchant)
+            profiler.record(SLICING, time.perf_counter_ns() - start)
+
+        fired = 0
+        for case, check in self.checks:
+            if not (check(c) if profiler is None else profiler.measure(case, check, c)):
+                fired |= 1 << (case - 1)
+                if case in GLOBAL_CBK_CASES:
+                    self.reject(case, c)
+
+        # Only the first failing case denies the transaction
+        if profiler is not None:
+            profiler.decide(first_case(fired))
+
+        return fired
+
+    # Scores the transaction and then adds it to the history (what process_database does for each row)
+    def process(self, transaction)-> int:
+        date, amount, user, card, device, merchant = transaction_fields(transaction)
+        return self.process_codes(date, amount, *self.encode(user, card, device, merchant), cbk_label(transaction))
+
+    # has_cbk -> None when the label is not known yet (added as no CBK, not counted in the labeled metrics)
+    def process_codes(self, date, amount, user, card, device, merchant, has_cbk)-> int:
+
+        metrics = self.metrics
+        first_transaction = metrics is not None and self.first_transaction(user)
+
+        status = self.score_codes(date, amount, user, card, device, merchant)
+        self.add_codes(date, amount, user, card, device, merchant, bool(has_cbk))
+
+        if metrics is not None:
+            metrics.record(date, status, has_cbk, first_transaction)
+
+        if self.retention is not None:
+            self.apply_retention()
+
+        return status
+
+    # Same as process_codes, returning the rule_mask of the transaction
+    def process_mask(self, date, amount, user, card, device, merchant, has_cbk)-> int:
+
+        metrics = self.metrics
+        first_transaction = metrics is not None and self.first_transaction(user)
+
+        fired = self.rule_mask(date, amount, user, card, device, merchant)
+        self.add_codes(date, amount, user, card, device, merchant, bool(has_cbk))
+
+        if metrics is not None:
+            metrics.record(date, first_case(fired), has_cbk, first_transaction)
+
+        if self.retention is not None:
+            self.apply_retention()
+
+        return fired
+
+    # The user has no transaction before this one (a user forgotten by the retention policy is remembered for the
+    # metrics by its key, see evict)
+    def first_transaction(self, user)-> bool:
+
+        if self.users.get(user) is not None:
+            return False
+        if not self.forgotten_users:
+            return True
+
+        return self.forgotten_users.pop(self.encoders["users"].decode(user), None) is None
+
+    # Same as process, returning the decision record of the scoring service and the stream output
+    def decide(self, transaction)-> dict:
+
+        # device_id is optional (blank in part of the history)
+        transaction.setdefault("device_id", None)
+
+        status = self.process(transaction)
+
+        # status == 0 -> transaction approved
+        # status != 0 -> in some cases the transaction was declined
+        if status != 0:
+            recommendation = "deny"
+        else:
+            recommendation = "approve"
+
+        return {"transaction_id": transaction.get("transaction_id"), "recommendation": recommendation,
+                "deny_case": status}
+
+    def candidate(self, date, amount, user, card, device, merchant)-> Candidate:
+
+        c = Candidate()
+        c.date = date
+        c.amount = amount
+        c.user = user
+        c.card = card
+        c.device = device
+        c.merchant = merchant
+
+        # Assuming we have the Chargeback information in 3 days (hypothetically)
+        c.cutoff = date - self.cbk_delay
+
+        c.user_history = self.users.get(user)
+        c.card_history = self.cards.get(card)
+        c.device_history = None if device == MISSING else self.devices.get(device)
+        c.merchant_history = self.merchants.get(merchant)
+
+        # Histories read from a snapshot join the queue when first scored against
+        for history in (c.user_history, c.card_history, c.device_history, c.merchant_history):
+            if history is not None and not history.tracked:
+                self.maturation.track(history)
+
+        # Older than the last scored transaction -> the counters are ahead, the rules search the histories
+        c.current = self.maturation.advance(date)
+
+        return c
+
+    #=============================================================================================================#
+    # Rules (same semantics as the functions in src.antifraud)
+
+    def _exceeded_limit(self, c)-> bool:
+
+        start = c.date - self.amount_window
+
+        for history in (c.user_history, c.card_history, c.device_history):
+            total = 0
+            if history is not None:
+                window = history.amounts[history.since(start):]
+                if window:
+                    total = amount_sum(window) + c.amount
+            if total > self.amount_limit:
+                return False
+
+        return True
+
+    def _too_late(self, c)-> bool:
+
+        hour = (c.date // HOUR_US) % 24
+
+        if c.amount >= self.high_value and ((hour >= self.start_period) or (hour <= self.end_period)):
+            return False
+
+        return True
+
+    def _many_transactions(self, history, c)-> bool:
+
+        if history is None:
+            return True
+
+        if len(history.dates) - history.since(c.date - self.transactions_window) >= self.limit:
+            return False
+
+        return True
+
+    def _many_cbks(self, history, c)-> bool:
+
+        # No transaction with CBK info yet
+        if history is None or history.first_date > c.cutoff:
+            return True
+
+        if c.current:
+            recent_cbks = history.recent_cbks
+        else:
+            recent_cbks = history.cbks(c.date - self.cbk_window, c.cutoff)
+
+        if recent_cbks > 1:
+            return False
+
+        return True
+
+    def _global_cbks(self, history, c)-> bool:
+
+        if history is None or history.first_date > c.cutoff:
+            return True
+
+        if c.current:
+            matured_cbks = history.matured_cbks
+        else:
+            matured_cbks = bisect_right(history.cbk_dates, c.cutoff) + history.folded_cbks
+
+        if matured_cbks > self.cbk_limit:
+            return False
+
+        return True
+
+    def _rotation(self, history, component, value, c)-> bool:
+
+        if history is None:
+            return True
+
+        start = c.date - self.rotation_window
+        position = history.since(start)
+        if position == len(history.dates):
+            return True
+
+        # Components seen with the entity in the window, from its link index when the window is long
+        if len(history.dates) - position < LINK_INDEX_ROWS:
+            recent_components = set(getattr(history, component)[position:])
+            recent_components.discard(MISSING)
+            distinct = len(recent_components)
+            value_seen = value in recent_components
+        else:
+            index = history.linked(component)
+            recent_components = index.since(start)
+            distinct = index.count(start)
+            value_seen = index.seen(value, start)
+
+        # A missing device is never a seen component, it counts as one more
+        total_components = distinct if value_seen else distinct + 1
+
+        if component == "cards":
+            if total_components >= self.max_components:
+                return False
+
+        else:
+            if total_components > self.max_components:
+                return False
+
+        # Components that already had a CBK (for any user, card or device), only counted up to 2
+        entities = getattr(self, component)
+        cbk_components = 0
+
+        if value == MISSING:
+            if self.missing_device_cbk is not None and self.missing_device_cbk <= c.cutoff:
+                cbk_components += 1
+
+        elif not value_seen:
+            entity = entities.get(value)
+            if entity is not None and entity.first_cbk is not None and entity.first_cbk <= c.cutoff:
+                cbk_components += 1
+
+        for key in recent_components:
+            if cbk_components >= 2:
+                break
+            first_cbk = entities[key].first_cbk
+            if first_cbk is not None and first_cbk <= c.cutoff:
+                cbk_components += 1
+
+        return cbk_components < 2
+
+###################################################################################################################
+# Normalizes a transaction (dict or pd.Series) to the values used by the engine
+
+# CBK flag as in the input spreadsheet ("TRUE" / "FALSE") or as a bool, None when unknown
+def cbk_label(transaction):
+
+    has_cbk = transaction.get("has_cbk")
+    if has_cbk is None or (not isinstance(has_cbk, str) and pd.isna(has_cbk)):
+        return None
+    if isinstance(has_cbk, str):
+        return has_cbk.upper() == "TRUE"
+
+    return bool(has_cbk)
+
+# Raises ValueError for a missing date or a non-finite amount (NaT would be scored as the year 1677)
+def transaction_fields(transaction)-> tuple:
+
+    date = pd.Timestamp(transaction["transaction_date"])
+    if pd.isna(date):
+        raise ValueError(f"Invalid transaction_date: {transaction['transaction_date']!r}")
+
+    amount = float(transaction["transaction_amount"])
+    if not np.isfinite(amount):
+        raise ValueError(f"Invalid transaction_amount: {transaction['transaction_amount']!r}")
+
+    device = transaction["device_id"]
+    device = None if pd.isna(device) else int(device)
+
+    return (date.value // 1000, amount, int(transaction["user_id"]), str(transaction["card_number"]), device,
+            int(transaction["merchant_id"]))
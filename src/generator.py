@@ -0,0 +1,124 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+START_DATE = "2019-11-01"
+
+# Share of the sample's transactions in each hour of the day (00h - 23h)
+HOUR_WEIGHTS = np.array([133, 111, 61, 30, 7, 4, 2, 3, 7, 29, 93, 111, 195, 247, 239, 278, 271, 278, 262, 272,
+                         227, 163, 176, 120], dtype=np.float64)
+
+COLUMNS = ["transaction_id", "merchant_id", "user_id", "card_number", "transaction_date", "transaction_amount",
+           "device_id", "has_cbk"]
+
+###################################################################################################################
+# Seeded synthetic transactions with the same schema as data/transactional-sample.csv
+# Generated one day at a time (in date order), so even 10M rows never need to be held in memory at once
+
+# rows                -> total number of transactions
+# cbk_rate            -> expected share of transactions with CBK (concentrated in risky users)
+# missing_device_rate -> share of transactions with a blank device_id
+# card_reuse_rate     -> share of transactions made with a card of another user
+# device_reuse_rate   -> share of transactions made on a device of another user
+def generate_transactions(rows, seed=0, days=30, start=START_DATE, cbk_rate=0.12, missing_device_rate=0.26,
+                          card_reuse_rate=0.02, device_reuse_rate=0.02, users=None, merchants=None):
+
+    rng = np.random.default_rng(seed)
+
+    # Around 1.2 transactions per user and 1.8 per merchant, like the sample
+    users = users or max(1, int(rows / 1.2))
+    merchants = merchants or max(1, int(rows / 1.8))
+
+    #-------------------------------------------------------------------------------------------------------------#
+    # Entities: a few heavy users make most of the repeated transactions
+
+    user_ids = rng.choice(np.arange(1, 10 * users + 1), size=users, replace=False)
+    user_cdf = np.cumsum(rng.pareto(2.5, size=users) + 1.0)
+    user_cdf /= user_cdf[-1]
+
+    # Risk of each user, mean cbk_rate and most of the CBKs in a small group of users
+    risk = rng.beta(0.2, 0.2 * (1 - cbk_rate) / cbk_rate, size=users) if 0 < cbk_rate < 1 else \
+        np.full(users, float(cbk_rate))
+
+    cards = card_numbers(rng, users)
+    device_ids = rng.choice(np.arange(1, 10 * users + 1), size=users, replace=False)
+    merchant_ids = rng.choice(np.arange(1, 10 * merchants + 1), size=merchants, replace=False)
+
+    hour_cdf = np.cumsum(HOUR_WEIGHTS) / HOUR_WEIGHTS.sum()
+    day_rows = rng.multinomial(rows, np.full(days, 1.0 / days))
+    first_day = pd.Timestamp(start).value // 1000
+
+    transaction_id = 21320398 - rows
+
+    #-------------------------------------------------------------------------------------------------------------#
+
+    for day, count in enumerate(day_rows):
+
+        if count == 0:
+            continue
+
+        user = np.searchsorted(user_cdf, rng.random(count))
+        card = np.where(rng.random(count) < card_reuse_rate, rng.integers(0, users, count), user)
+        device = np.where(rng.random(count) < device_reuse_rate, rng.integers(0, users, count), user)
+
+        # Microseconds since the start date, following the hourly profile of the sample
+        hour = np.searchsorted(hour_cdf, rng.random(count))
+        micros = first_day + (day * 24 + hour) * 3_600_000_000 + rng.integers(0, 3_600_000_000, count)
+        order = np.argsort(micros, kind="stable")
+
+        amount = np.clip(np.round(rng.lognormal(6.0, 1.0, count), 2), 1.0, 4100.0)
+
+        chunk = pd.DataFrame({
+            "transaction_id": np.arange(transaction_id, transaction_id + count),
+            "merchant_id": merchant_ids[rng.integers(0, merchants, count)],
+            "user_id": user_ids[user][order],
+            "card_number": cards[card][order],
+            "transaction_date": np.datetime_as_string(np.sort(micros).astype("datetime64[us]"), unit="us"),
+            "transaction_amount": amount,
+            "device_id": pd.array(np.where(rng.random(count) < missing_device_rate, -1, device_ids[device])[order],
+                                  dtype="Int64"),
+            "has_cbk": np.where(rng.random(count) < risk[user][order], "TRUE", "FALSE"),
+        })
+        chunk.loc[chunk["device_id"] == -1, "device_id"] = pd.NA
+
+        transaction_id += count
+        yield chunk
+
+# Masked card numbers as in the sample (6-digit BIN, ****** and last 4 digits)
+def card_numbers(rng, size):
+
+    bins = rng.integers(400000, 660000, size=410)[rng.integers(0, 410, size)]
+    last = rng.integers(0, 10000, size)
+
+    return np.char.add(np.char.add(bins.astype(str), "******"), np.char.zfill(last.astype(str), 4)).astype(object)
+
+###################################################################################################################
+
+def write_transactions(output_path, rows, **options):
+
+    with open(output_path, "w", encoding="utf-8", newline="") as file:
+        file.write(",".join(COLUMNS) + "\n")
+        for chunk in generate_transactions(rows, **options):
+            chunk.to_csv(file, header=False, index=False)
+
+# All generated transactions in one DataFrame (parsed like read_input)
+def generate_frame(rows, **options):
+
+    df = pd.concat(generate_transactions(rows, **options), ignore_index=True)
+    df["transaction_date"] = pd.to_datetime(df["transaction_date"])
+    df["has_cbk"] = df["has_cbk"] == "TRUE"
+    df["device_id"] = df["device_id"].astype(np.float64)
+
+    return df
+
+###################################################################################################################
+
+# python -m src.generator ROWS [output.csv] [seed]
+if __name__ == "__main__":
+    rows = int(sys.argv[1])
+    output_path = sys.argv[2] if len(sys.argv) > 2 else f"./data/transactional-synthetic-{rows}.csv"
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+
+    write_transactions(output_path, rows, seed=seed)
+    print(f"{rows} transactions written to {output_path}")
@@ -0,0 +1,84 @@
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.antifraud import INPUT_PATH, read_input
+from src.backtest import score_frame
+
+GRID_PATH = "./data/grid-search.csv"
+
+# Values around the current thresholds (any keyword argument of backtest.score_frame can be swept)
+DEFAULT_GRID = {
+    "amount_limit": [750, 1000, 1500],
+    "time_window_hours": [2, 4, 8],
+    "limit": [3, 4],
+    "cbk_limit": [3, 5],
+    "max_components": [2, 3],
+}
+
+###################################################################################################################
+# Hits and misses in the same categories as graph 3
+
+def hits_and_misses(has_cbk, deny_case)-> dict:
+
+    denied = deny_case != 0
+
+    return {
+        "Hit - Legit Approved": int(np.sum(~has_cbk & ~denied)),
+        "Hit - CBK Denied": int(np.sum(has_cbk & denied)),
+        "Miss - CBK Approved": int(np.sum(has_cbk & ~denied)),
+        "Miss - Legit Denied": int(np.sum(~has_cbk & denied)),
+    }
+
+# Every combination of the values in the grid
+def parameter_grid(grid)-> list:
+    return [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+
+###################################################################################################################
+# Worker side: the parsed input is set once per process (inherited without copying where fork is available)
+
+_transactions = None
+
+def _init_worker(transactions):
+    global _transactions
+    _transactions = transactions
+
+def _evaluate(params)-> dict:
+    deny_case = score_frame(_transactions, **params)
+    return {**params, **hits_and_misses(_transactions["has_cbk"].to_numpy(bool), deny_case)}
+
+###################################################################################################################
+# Replays the input once per configuration of the grid in a process pool (vectorized backtest for each one)
+
+def grid_search(grid=DEFAULT_GRID, input_path=INPUT_PATH, output_path=GRID_PATH, workers=None):
+
+    transactions = read_input(input_path)
+    configurations = parameter_grid(grid)
+
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+    workers = min(workers or os.cpu_count() or 1, len(configurations))
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(transactions,)) as executor:
+        results = list(executor.map(_evaluate, configurations))
+
+    report = pd.DataFrame(results)
+    report = report.sort_values(by=["Miss - CBK Approved", "Miss - Legit Denied"]).reset_index(drop=True)
+
+    if output_path is not None:
+        report.to_csv(output_path, index=False, encoding="utf-8")
+
+    print(f"{len(configurations)} configurations evaluated with {workers} workers")
+    print(report.to_string(index=False))
+
+    return report
+
+###################################################################################################################
+
+if __name__ == "__main__":
+    grid_search()
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+###################################################################################################################
+# Append-only history with one preallocated numpy array per column
+# Rows are written in place and the arrays double when full, so adding a transaction never copies the history
+
+class HistoryBuffer:
+
+    def __init__(self, dtypes, capacity=1024):
+
+        self.size = 0
+        self.columns = {}
+
+        for column, dtype in dtypes.items():
+            # Extension dtypes (e.g. pandas strings) are kept as Python objects
+            dtype = dtype if isinstance(dtype, np.dtype) else np.dtype(object)
+            self.columns[column] = np.empty(max(capacity, 1), dtype=dtype)
+
+    def __len__(self)-> int:
+        return self.size
+
+    def append(self, row):
+
+        if self.size == self.capacity:
+            self.grow(2 * self.capacity)
+
+        for column, values in self.columns.items():
+            value = row[column]
+            if values.dtype.kind == "M":
+                value = np.datetime64(pd.Timestamp(value).value, "ns")
+            values[self.size] = value
+
+        self.size += 1
+
+    @property
+    def capacity(self)-> int:
+        return len(next(iter(self.columns.values())))
+
+    def grow(self, capacity):
+
+        for column, values in self.columns.items():
+            grown = np.empty(capacity, dtype=values.dtype)
+            grown[:self.size] = values[:self.size]
+            self.columns[column] = grown
+
+    #-------------------------------------------------------------------------------------------------------------#
+    # Views over the filled rows (no data is copied)
+
+    def column(self, name):
+        return self.columns[name][:self.size]
+
+    def frame(self):
+        return pd.DataFrame({column: values[:self.size] for column, values in self.columns.items()}, copy=False)
@@ -0,0 +1,172 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.compact import micros
+
+DAY_US = micros(days=1)
+
+HIT_LEGIT_APPROVED = "Hit - Legit Approved"
+HIT_CBK_DENIED = "Hit - CBK Denied"
+MISS_CBK_APPROVED = "Miss - CBK Approved"
+MISS_LEGIT_DENIED = "Miss - Legit Denied"
+
+# Label of the transactions in the per-case counts (None -> CBK still unknown when it was decided)
+LABELS = {False: 0, True: 1, None: 2}
+
+###################################################################################################################
+# Running aggregates of the decisions, updated as each transaction is decided (see ScoringEngine.process_codes)
+# confusion      -> hits and misses of the labeled decisions
+# cases          -> decisions of each deny_case (0 = approved) split by label: [legit, CBK, unlabeled]
+# daily          -> approved and denied transactions of each day
+# cbk_approved   -> approved CBKs (misses) and how many of them were the first transaction of their user
+# Small enough to be saved as JSON after any number of decisions, so reports never rescan the history
+
+class DecisionMetrics:
+
+    def __init__(self):
+        self.decisions = 0
+        self.confusion = {HIT_LEGIT_APPROVED: 0, HIT_CBK_DENIED: 0, MISS_CBK_APPROVED: 0, MISS_LEGIT_DENIED: 0}
+        self.cases = {}
+        self.daily = {}
+        self.first_transaction_misses = 0
+
+    # date in epoch microseconds, has_cbk None when the label is not known yet
+    def record(self, date, status, has_cbk, first_transaction=False):
+
+        self.decisions += 1
+
+        counts = self.cases.get(status)
+        if counts is None:
+            counts = self.cases[status] = [0, 0, 0]
+        counts[LABELS[has_cbk]] += 1
+
+        day = self.daily.get(date // DAY_US)
+        if day is None:
+            day = self.daily[date // DAY_US] = [0, 0]
+        day[status != 0] += 1
+
+        if has_cbk is None:
+            return
+
+        if status == 0:
+            if has_cbk:
+                self.confusion[MISS_CBK_APPROVED] += 1
+                self.first_transaction_misses += first_transaction
+            else:
+                self.confusion[HIT_LEGIT_APPROVED] += 1
+        else:
+            self.confusion[HIT_CBK_DENIED if has_cbk else MISS_LEGIT_DENIED] += 1
+
+    # Adds the decisions of other metrics (e.g. of another segment of the same replay, see src.parallel)
+    def merge(self, other):
+
+        self.decisions += other.decisions
+        for name, count in other.confusion.items():
+            self.confusion[name] += count
+        for status, counts in other.cases.items():
+            mine = self.cases.setdefault(status, [0, 0, 0])
+            for i, count in enumerate(counts):
+                mine[i] += count
+        for day, counts in other.daily.items():
+            mine = self.daily.setdefault(day, [0, 0])
+            for i, count in enumerate(counts):
+                mine[i] += count
+        self.first_transaction_misses += other.first_transaction_misses
+
+    #=============================================================================================================#
+    # Queries
+
+    def confusion_matrix(self)-> pd.DataFrame:
+        return pd.DataFrame({"approve": [self.confusion[HIT_LEGIT_APPROVED], self.confusion[MISS_CBK_APPROVED]],
+                             "deny": [self.confusion[MISS_LEGIT_DENIED], self.confusion[HIT_CBK_DENIED]]},
+                            index=pd.Index(["legit", "cbk"], name="has_cbk"))
+
+    def case_counts(self)-> pd.DataFrame:
+        cases = sorted(self.cases)
+        return pd.DataFrame([self.cases[case] for case in cases], columns=["legit", "cbk", "unlabeled"],
+                            index=pd.Index(cases, name="deny_case"))
+
+    def daily_volumes(self)-> pd.DataFrame:
+        days = sorted(self.daily)
+        return pd.DataFrame([self.daily[day] for day in days], columns=["approve", "deny"],
+                            index=pd.Index(pd.to_datetime(np.array(days, dtype=np.int64) * DAY_US, unit="us"),
+                                           name="day"))
+
+    # Statistics of the graphs of src.plot_graph
+    def statistics(self)-> dict:
+
+        legit = sum(counts[0] for counts in self.cases.values())
+        cbk = sum(counts[1] for counts in self.cases.values())
+        approved = sum(day[0] for day in self.daily.values())
+        denied = sum(day[1] for day in self.daily.values())
+
+        return {
+            "transactions": {"Without CBK": legit, "With CBK": cbk},
+            "recommendations": {"Approved": approved, "Denied": denied},
+            "hits_and_misses": dict(self.confusion),
+            "denied_cases": {str(case): {"Legit Denied": counts[0], "CBK Denied": counts[1]}
+                             for case, counts in sorted(self.cases.items()) if case != 0},
+            "cbk_approved": {"total": self.confusion[MISS_CBK_APPROVED],
+                             "first_transaction": self.first_transaction_misses},
+        }
+
+    #=============================================================================================================#
+    # Persistence
+
+    def to_dict(self)-> dict:
+        return {
+            "decisions": self.decisions,
+            "confusion": self.confusion,
+            "cases": {str(case): counts for case, counts in sorted(self.cases.items())},
+            "daily": {str(pd.Timestamp(day * DAY_US, unit="us").date()): counts
+                      for day, counts in sorted(self.daily.items())},
+            "first_transaction_misses": self.first_transaction_misses,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+
+        metrics = cls()
+        metrics.decisions = data["decisions"]
+        metrics.confusion.update(data["confusion"])
+        metrics.cases = {int(case): list(counts) for case, counts in data["cases"].items()}
+        metrics.daily = {pd.Timestamp(day).value // 1000 // DAY_US: list(counts)
+                         for day, counts in data["daily"].items()}
+        metrics.first_transaction_misses = data["first_transaction_misses"]
+
+        return metrics
+
+    def save(self, path):
+
+        # Replaced atomically, a reader never sees a partial file
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as file:
+            return cls.from_dict(json.load(file))
+
+    # Metrics of an already processed history (for the scorers that don't keep them while deciding)
+    @classmethod
+    def from_frame(cls, historical):
+
+        metrics = cls()
+        dates = pd.to_datetime(historical["transaction_date"]).to_numpy("datetime64[us]").astype(np.int64)
+        first_date = pd.Series(dates).groupby(historical["user_id"].to_numpy()).transform("min").to_numpy()
+
+        for date, status, has_cbk, first in zip(dates.tolist(), historical["deny_case"].astype(int).tolist(),
+                                                historical["has_cbk"].astype(bool).tolist(),
+                                                (dates == first_date).tolist()):
+            metrics.record(date, status, has_cbk, first)
+
+        return metrics
+
+# Metrics saved next to a result spreadsheet or store
+def metrics_path(history_path)-> str:
+    return os.path.splitext(history_path)[0] + ".metrics.json"
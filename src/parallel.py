@@ -0,0 +1,143 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.metrics import DecisionMetrics
+from src.profiling import RuleProfiler
+from src.store import ENTITIES, merge_aggregates, partition_aggregates
+
+###################################################################################################################
+# Time-partitioned replay
+# The rules look back at most horizon() (the all-time CBK counts of cases 9-11 are sums), so the sorted timeline is
+# cut into segments replayed by separate processes. Each segment starts from the aggregates of the transactions
+# before its lookback window (ScoringEngine.fold) plus the transactions of the window (ScoringEngine.load): the
+# same state the sequential replay reaches at the start of the segment, so the decisions are the same
+
+# (warm, start, end) row ranges of each segment: rows warm:start are its lookback window, start:end are replayed
+def segment_bounds(dates, segments, horizon)-> list:
+
+    starts = np.linspace(0, len(dates), segments + 1).astype(np.int64)
+
+    bounds = []
+    for start, end in zip(starts[:-1].tolist(), starts[1:].tolist()):
+        if start == end:
+            continue
+        warm = int(np.searchsorted(dates, dates[start] - horizon, side="left"))
+        bounds.append((warm, start, end))
+
+    return bounds
+
+# Arguments of the engine fold for the transactions before each lookback window (None for the first segment)
+def segment_folds(df, bounds)-> list:
+
+    cbk_dates = df["transaction_date"][df["has_cbk"].astype(bool) & df["device_id"].isna()]
+
+    folds = []
+    aggregates = None
+    folded = 0
+    for warm, _, end in bounds:
+
+        if warm > folded:
+            part = partition_aggregates(df.iloc[folded:warm])
+            aggregates = part if aggregates is None else {name: merge_aggregates([aggregates[name], frame])
+                                                          for name, frame in part.items()}
+            folded = warm
+
+        if aggregates is None:
+            folds.append(None)
+            continue
+
+        # A segment only looks up the entities of its own transactions, the others don't need to be folded
+        frame = df.iloc[warm:end]
+        needed = {}
+        for name, column in ENTITIES:
+            keys = frame[column].dropna().astype(str if name == "cards" else np.int64).unique()
+            needed[name] = aggregates[name][aggregates[name]["key"].isin(keys)]
+
+        # First CBK without device among the folded transactions (the dates are sorted)
+        missing = cbk_dates[cbk_dates.index < warm]
+        folds.append((needed, warm, missing.iloc[0] if len(missing) else None))
+
+    return folds
+
+def replay_segment(frame, warm_rows, fold, profiled, all_rules, params)-> tuple:
+
+    # Imported here because the engine reuses the constants of src.antifraud
+    from src.antifraud import replay_engine
+    from src.engine import ScoringEngine, paused_gc
+
+    engine = ScoringEngine(**params).retain()
+    with paused_gc():
+        if fold is not None:
+            engine.fold(*fold)
+        engine.load(frame.iloc[:warm_rows])
+
+    engine.metrics = DecisionMetrics()
+    engine.profiler = RuleProfiler() if profiled else None
+
+    historical = replay_engine(frame.iloc[warm_rows:].reset_index(drop=True), engine=engine, all_rules=all_rules)
+    fired_rules = historical["fired_rules"].to_numpy(np.int32) if all_rules else None
+
+    return historical["deny_case"].to_numpy(np.int64), fired_rules, engine.metrics, engine.profiler
+
+#-----------------------------------------------------------------------------------------------------------------#
+
+# df       -> transactions sorted by date (see read_input)
+# workers  -> processes replaying the segments, one segment each (1 replays in this process)
+# progress -> optional src.antifraud.ProgressReport, told about each finished segment
+# all_rules -> also the fired_rules column (see src.antifraud.replay_engine)
+# Returns the historical with the results and its DecisionMetrics
+def replay_parallel(df, workers=None, profiler=None, progress=None, all_rules=False, **params)-> tuple:
+
+    from src.engine import ScoringEngine
+
+    workers = max(1, min(workers or os.cpu_count() or 1, len(df)))
+    horizon = ScoringEngine(**params).horizon()
+
+    dates = df["transaction_date"].to_numpy("datetime64[us]").astype(np.int64)
+    bounds = segment_bounds(dates, workers, horizon)
+    folds = segment_folds(df, bounds)
+
+    # Each segment gets its lookback window and its own rows
+    frames = [df.iloc[warm:end] for warm, _, end in bounds]
+    warm_rows = [start - warm for warm, start, _ in bounds]
+    arguments = (frames, warm_rows, folds, [profiler is not None] * len(bounds), [all_rules] * len(bounds),
+                 [params] * len(bounds))
+
+    if len(bounds) <= 1:
+        results = map(replay_segment, *arguments)
+        executor = None
+    else:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        executor = ProcessPoolExecutor(max_workers=len(bounds), mp_context=context)
+        results = executor.map(replay_segment, *arguments)
+
+    try:
+        deny_cases = []
+        fired_rules = []
+        metrics = DecisionMetrics()
+        for (warm, start, end), (cases, fired, segment_metrics, segment_profiler) in zip(bounds, results):
+            deny_cases.append(cases)
+            fired_rules.append(fired)
+            metrics.merge(segment_metrics)
+            if profiler is not None:
+                profiler.merge(segment_profiler)
+            if progress is not None:
+                progress.add(end - start)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    deny_cases = np.concatenate(deny_cases) if deny_cases else np.empty(0, dtype=np.int64)
+
+    # Add columns to help with analysis
+    historical = df.copy()
+    historical["recommendation"] = np.where(deny_cases != 0, "deny", "approve").astype(object)
+    historical["deny_case"] = deny_cases
+    if all_rules:
+        historical["fired_rules"] = np.concatenate(fired_rules) if fired_rules else np.empty(0, dtype=np.int32)
+
+    return historical, metrics
@@ -1,7 +1,8 @@
 import pandas as pd
 from datetime import datetime
 
-from src.antifraud import analyzes_transaction
+from src.antifraud import OUTPUT_PATH
+from src.snapshot import open_engine
 
 
 def menu():
@@ -22,9 +23,15 @@ def menu():
         else:
             print("Invalid option. Please try again.")
 
-def process_transaction():
+# Decision record of one transaction (dictionary like the sample below) against the processed history, which is
+# left unchanged
+def score_transaction(transaction, history_path=OUTPUT_PATH, **params)-> dict:
+    return open_engine(history_path, **params).decide(transaction)
 
-    historical = pd.read_csv("./data/transactional-result.csv", parse_dates=["transaction_date"])
+def process_transaction(history_path=OUTPUT_PATH):
+
+    # Processed history (snapshot written by process_database, or the spreadsheet itself)
+    engine = open_engine(history_path)
 
     choice = menu()
     transaction = {}
@@ -67,7 +74,7 @@ def process_transaction():
     transaction = pd.Series(transaction)
 
     # Classifies a transaction based on history
-    status = analyzes_transaction(transaction, historical)
+    status = engine.score(transaction)
 
     # status == 0 -> transaction approved
     # status != 0 -> in some cases the transaction was declined
@@ -1,34 +1,114 @@
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+
+# Figures are only saved to files, never shown (works without a display)
+matplotlib.use("Agg")
+
 import pandas as pd
 import matplotlib.pyplot as plt
 
-def plot():
-
-    # Reading the spreadsheet
-    historical = pd.read_csv("./data/transactional-result.csv", parse_dates=["transaction_date"])
-
-    case_descriptions = {
-        1.0: "Case 1",
-        2.0: "Case 2",
-        3.0: "Case 3",
-        4.0: "Case 4",
-        5.0: "Case 5",
-        6.0: "Case 6",
-        7.0: "Case 7",
-        8.0: "Case 8",
-        9.0: "Case 9",
-        10.0: "Case 10",
-        11.0: "Case 11",
-        12.0: "Case 12",
-        13.0: "Case 13",
-        14.0: "Case 14",
-        15.0: "Case 15",
-        16.0: "Case 16"
-    }
-
-    #---------------------------------------------------------------------------------------------------------#
-    # Graph 1: Transactions with CBK
-
-    cbk_counts = historical["has_cbk"].value_counts()
+from src.antifraud import OUTPUT_PATH
+from src.metrics import DecisionMetrics, metrics_path
+from src.snapshot import read_history
+from src.store import source_fingerprint
+
+GRAPH_DIR = "./data"
+MISSES_NAME = "cbk_approved_misses.csv"
+
+MISSES_VERSION = 1
+
+# Columns the metrics of a history without a metrics file are counted from (see history_statistics)
+METRICS_COLUMNS = ["user_id", "transaction_date", "has_cbk", "deny_case"]
+
+case_descriptions = {
+    1.0: "Case 1",
+    2.0: "Case 2",
+    3.0: "Case 3",
+    4.0: "Case 4",
+    5.0: "Case 5",
+    6.0: "Case 6",
+    7.0: "Case 7",
+    8.0: "Case 8",
+    9.0: "Case 9",
+    10.0: "Case 10",
+    11.0: "Case 11",
+    12.0: "Case 12",
+    13.0: "Case 13",
+    14.0: "Case 14",
+    15.0: "Case 15",
+    16.0: "Case 16"
+}
+
+###################################################################################################################
+# Statistics of the five graphs, from the decision metrics saved with the history by replay and serve (see
+# src.metrics), so a report never rescans the history; counted from the history when it has none
+
+def history_statistics(history_path=OUTPUT_PATH)-> dict:
+
+    path = metrics_path(history_path)
+    if os.path.exists(path):
+        return DecisionMetrics.load(path).statistics()
+
+    return DecisionMetrics.from_frame(read_history(history_path, columns=METRICS_COLUMNS)).statistics()
+
+#-----------------------------------------------------------------------------------------------------------------#
+# Approved CBKs (misses) saved to a spreadsheet for manual analysis, exported again only when the history changed
+# or the spreadsheet is no longer the one written from it
+
+def misses_cache_path(history_path)-> str:
+    return os.path.splitext(history_path)[0] + ".misses.json"
+
+# Version of the misses spreadsheet, None when it is missing
+def misses_fingerprint(misses_path):
+    try:
+        return {"path": os.path.abspath(misses_path), **source_fingerprint(misses_path)}
+    except OSError:
+        return None
+
+def save_misses(history_path=OUTPUT_PATH, misses_path=None):
+
+    path = misses_cache_path(history_path)
+    source = source_fingerprint(history_path)
+
+    try:
+        with open(path, encoding="utf-8") as file:
+            cache = json.load(file)
+        if (cache.get("version") == MISSES_VERSION and cache.get("source") == source
+                and cache.get("misses") is not None and cache.get("misses") == misses_fingerprint(misses_path)):
+            return
+    except (OSError, ValueError):
+        pass
+
+    historical = read_history(history_path)
+    misses = historical["has_cbk"].astype(bool) & (historical["recommendation"].str.lower() == "approve")
+    historical[misses.to_numpy()].to_csv(misses_path, index=False)
+
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump({"version": MISSES_VERSION, "source": source, "misses": misses_fingerprint(misses_path)}, file)
+
+###################################################################################################################
+# Graphs, each one rendered to a file from the statistics (in any process)
+
+def annotate_bars(ax):
+    for p in ax.patches:
+        ax.annotate(f'{p.get_height()}',
+                    (p.get_x() + p.get_width() / 2., p.get_height()),
+                    ha='center', va='center',
+                    xytext=(0, 5),
+                    textcoords='offset points',
+                    fontsize=10)
+
+#---------------------------------------------------------------------------------------------------------#
+# Graph 1: Transactions with CBK
+
+def graph_transactions(stats, graph_dir):
+
+    # Most frequent first, like value_counts
+    cbk_counts = pd.Series(stats["transactions"]).sort_values(ascending=False, kind="stable")
     plt.figure(figsize=(5, 4))
 
     ax = cbk_counts.plot(kind="bar", color=["#66b3ff", "#FFD580"], edgecolor="black")
@@ -37,25 +117,21 @@ def plot():
     plt.title("Transactions")
     plt.xlabel("CBK Status")
     plt.ylabel("Number of Transactions")
-    plt.xticks([0, 1], ["Without CBK", "With CBK"], rotation=0)
+    plt.xticks([0, 1], cbk_counts.index, rotation=0)
     plt.grid(axis="y", linestyle="--", alpha=0.6)
 
     # Adding labels
-    for p in ax.patches:
-        ax.annotate(f'{p.get_height()}',
-                    (p.get_x() + p.get_width() / 2., p.get_height()),
-                    ha='center', va='center',
-                    xytext=(0, 5),
-                    textcoords='offset points',
-                    fontsize=10)
+    annotate_bars(ax)
 
-    plt.savefig("./data/graph-1-transactions.png", dpi=300, bbox_inches="tight")
-    plt.show()
+    plt.savefig(os.path.join(graph_dir, "graph-1-transactions.png"), dpi=300, bbox_inches="tight")
+    plt.close("all")
 
-    #---------------------------------------------------------------------------------------------------------#
-    # Graph 2: Transactions approved/denied
+#---------------------------------------------------------------------------------------------------------#
+# Graph 2: Transactions approved/denied
 
-    rec_counts = historical["recommendation"].value_counts()
+def graph_recommendations(stats, graph_dir):
+
+    rec_counts = pd.Series(stats["recommendations"]).sort_values(ascending=False, kind="stable")
     plt.figure(figsize=(5, 4))
 
     ax = rec_counts.plot(kind="bar", color=["#4CAF50", "#F44336"], edgecolor="black")
@@ -64,48 +140,26 @@ def plot():
     plt.title("Approved vs Denied")
     plt.xlabel("Recommendation")
     plt.ylabel("Number of Transactions")
-    plt.xticks([0, 1], ["Approved", "Denied"], rotation=0)
+    plt.xticks([0, 1], rec_counts.index, rotation=0)
     plt.grid(axis="y", linestyle="--", alpha=0.6)
 
     # Adding labels
-    for p in ax.patches:
-        ax.annotate(f'{p.get_height()}', 
-                    (p.get_x() + p.get_width() / 2., p.get_height()), 
-                    ha='center', va='center', 
-                    xytext=(0, 5), 
-                    textcoords='offset points',
-                    fontsize=10)
+    annotate_bars(ax)
+
+    plt.savefig(os.path.join(graph_dir, "graph-2-apr-den.png"), dpi=300, bbox_inches="tight")
+    plt.close("all")
 
-    plt.savefig("./data/graph-2-apr-den.png", dpi=300, bbox_inches="tight")
-    plt.show()
-
-    #---------------------------------------------------------------------------------------------------------#
-    # Graph 3: Hits and Misses
-    
-    # Finding hits and misses
-    hit_cbk_denied = len(historical[(historical["has_cbk"] == True) 
-                            & (historical["recommendation"] == "deny")])
-    
-    hit_legit_approved = len(historical[(historical["has_cbk"] == False) 
-                            & (historical["recommendation"] == "approve")])
-    
-    miss_cbk_approved = len(historical[(historical["has_cbk"] == True) 
-                            & (historical["recommendation"] == "approve")])
-    
-    miss_legit_denied = len(historical[(historical["has_cbk"] == False) 
-                            & (historical["recommendation"] == "deny")])
-
-    data = pd.Series({
-        "Hit - Legit Approved": hit_legit_approved,
-        "Hit - CBK Denied": hit_cbk_denied,
-        "Miss - CBK Approved": miss_cbk_approved,
-        "Miss - Legit Denied": miss_legit_denied
-    })
+#---------------------------------------------------------------------------------------------------------#
+# Graph 3: Hits and Misses
+
+def graph_hits_and_misses(stats, graph_dir):
+
+    data = pd.Series(stats["hits_and_misses"])
 
     # Create graph
     plt.figure(figsize=(8, 5))
     colors = ["#4CAF50", "#81C784", "#E57373", "#F44336"]
-    bars = data.plot(kind="bar", color=colors, edgecolor="black")
+    data.plot(kind="bar", color=colors, edgecolor="black")
     plt.title("Hits and Misses", fontsize=14, fontweight="bold")
     plt.ylabel("Number of Transactions")
     plt.xticks(rotation=15, ha="right", fontsize=10)
@@ -116,26 +170,15 @@ def plot():
         plt.text(i, valor + (max(data)*0.02), f"{valor}", ha="center", fontsize=10, fontweight="bold")
 
     plt.tight_layout()
-    plt.savefig("./data/graph-3-hits-misses.png", dpi=300, bbox_inches="tight")
-    plt.show()
-
-    #---------------------------------------------------------------------------------------------------------#
-    # Graph 4: 
+    plt.savefig(os.path.join(graph_dir, "graph-3-hits-misses.png"), dpi=300, bbox_inches="tight")
+    plt.close("all")
 
-    # Finding all denied transactions
-    all_denies = historical[historical["recommendation"].str.lower() == "deny"].copy()
+#---------------------------------------------------------------------------------------------------------#
+# Graph 4: Cases that denied legit and CBK transactions
 
-    # Count how many cases denied 
-    legit_denied = all_denies[all_denies["has_cbk"] == False]["deny_case"].value_counts()
-    cbk_denied   = all_denies[all_denies["has_cbk"] == True]["deny_case"].value_counts()
-
-    # Combine the indexes
-    cases = sorted(set(legit_denied.index).union(cbk_denied.index))
-    df_cmp = pd.DataFrame({
-        "Legit Denied": legit_denied.reindex(cases, fill_value=0),
-        "CBK Denied": cbk_denied.reindex(cases, fill_value=0)
-    })
+def graph_denied_cases(stats, graph_dir):
 
+    df_cmp = pd.DataFrame.from_dict(stats["denied_cases"], orient="index", columns=["Legit Denied", "CBK Denied"])
     df_cmp.index = df_cmp.index.map(lambda x: case_descriptions.get(int(x), f"Case {x}"))
 
     # plot grouped bars
@@ -153,42 +196,23 @@ def plot():
                         ha="center", va="bottom", fontsize=9, fontweight="bold")
 
     plt.tight_layout()
-    plt.savefig("./data/graph-4-denied-cases.png", dpi=300, bbox_inches="tight")
-    plt.show()
-
-    #---------------------------------------------------------------------------------------------------------#
-    # Graph 5: Distribution of approved CBKS 
-
-    # Finding approved CBKs     (Misses)
-    cbk_approved = historical[
-        (historical["has_cbk"] == True) &
-        (historical["recommendation"].str.lower() == "approve")
-    ].copy()
-
-    # Saving to spreadsheet for manual analysis 
-    cbk_approved.to_csv("./data/cbk_approved_misses.csv", index=False)
-
-    # Finding the first transaction of each user
-    first_transaction = historical.groupby("user_id")["transaction_date"].min().reset_index()
-    first_transaction.rename(columns={"transaction_date": "first_transaction_date"}, inplace=True)
+    plt.savefig(os.path.join(graph_dir, "graph-4-denied-cases.png"), dpi=300, bbox_inches="tight")
+    plt.close("all")
 
-    # Merging approved CBKs with First Transactions
-    cbk_approved = cbk_approved.merge(first_transaction, on="user_id", how="left")
+#---------------------------------------------------------------------------------------------------------#
+# Graph 5: Distribution of approved CBKS
 
-    # Check if the CBK aproved date is the same of a First Transaction of any user
-    cbk_approved["is_first_transaction"] = (
-        cbk_approved["transaction_date"] == cbk_approved["first_transaction_date"]
-    )
+def graph_cbk_users(stats, graph_dir):
 
-    total_cbk_approved = len(cbk_approved)
-    first_time_cbk = cbk_approved["is_first_transaction"].sum()
+    total_cbk_approved = stats["cbk_approved"]["total"]
+    first_time_cbk = stats["cbk_approved"]["first_transaction"]
     recurring_cbk = total_cbk_approved - first_time_cbk
 
     # Graph info
     labels = ["1st Transaction (New User)", "Old User"]
     sizes = [first_time_cbk, recurring_cbk]
     colors = ["#ff9999","#66b3ff"]
-    explode = (0.1, 0) 
+    explode = (0.1, 0)
 
     # Adding labels
     fig, ax = plt.subplots(figsize=(6, 6))
@@ -200,11 +224,48 @@ def plot():
 
     ax.set_title("Distribution of Approved CBKs\n(New Users vs Old Users)", fontsize=13, fontweight='bold')
     plt.tight_layout()
-    plt.savefig("./data/graph-5-cbk-users.png", dpi=300, bbox_inches="tight")
-    plt.show()
+    plt.savefig(os.path.join(graph_dir, "graph-5-cbk-users.png"), dpi=300, bbox_inches="tight")
+    plt.close("all")
+
+GRAPHS = (graph_transactions, graph_recommendations, graph_hits_and_misses, graph_denied_cases, graph_cbk_users)
+
+def render(graph, stats, graph_dir):
+    graph(stats, graph_dir)
+
+###################################################################################################################
+
+# Approved CBKs spreadsheet of a history, saved with its graphs (named after the history unless it is the default one)
+def misses_path(history_path=OUTPUT_PATH, graph_dir=GRAPH_DIR)-> str:
+
+    if os.path.abspath(history_path) == os.path.abspath(OUTPUT_PATH):
+        return os.path.join(graph_dir, MISSES_NAME)
+
+    name = os.path.splitext(os.path.basename(os.path.normpath(history_path)))[0]
+    return os.path.join(graph_dir, f"{name}-{MISSES_NAME}")
+
+# history_path  -> result spreadsheet or columnar store (see src.store)
+# export_misses -> also save the approved CBKs (reads every column when the history changed, see save_misses)
+# misses        -> path of the approved CBKs spreadsheet (default: misses_path)
+# workers       -> processes rendering the graphs (1 renders them in this process)
+def plot(history_path=OUTPUT_PATH, export_misses=True, graph_dir=GRAPH_DIR, workers=None, misses=None):
+
+    if export_misses and misses is None:
+        misses = misses_path(history_path, graph_dir)
+
+    stats = history_statistics(history_path)
+    if export_misses:
+        save_misses(history_path, misses)
+
+    workers = min(workers or os.cpu_count() or 1, len(GRAPHS))
 
-    print("Graphs saved in: '/data'")
-    #---------------------------------------------------------------------------------------------------------#
+    if workers == 1:
+        for graph in GRAPHS:
+            render(graph, stats, graph_dir)
+    else:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else None)
 
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            list(executor.map(render, GRAPHS, [stats] * len(GRAPHS), [graph_dir] * len(GRAPHS)))
 
-    
\ No newline at end of file
+    print(f"Graphs saved in: '{graph_dir}'")
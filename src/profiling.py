@@ -0,0 +1,175 @@
+import time
+
+import pandas as pd
+
+# Security cases of analyzes_transaction / ScoringEngine
+CASES = {
+    1: "Exceeded value limit in a period",
+    2: "High value for the period",
+    3: "User made many transactions in a period",
+    4: "Card made many transactions in a period",
+    5: "Device made many transactions in a period",
+    6: "User with more than 1 CBK in 7 days",
+    7: "Card with more than 1 CBK in 7 days",
+    8: "Device with more than 1 CBK in 7 days",
+    9: "User with more than 5 CBK in their history",
+    10: "Card with more than 5 CBK in their history",
+    11: "Device with more than 5 CBK in their history",
+    12: "User with many cards",
+    13: "User with many devices",
+    14: "Card with many devices",
+    15: "Card with many users",
+    16: "Device with many users",
+    17: "Device with many cards",
+    18: "Merchant with more than 1 CBK in 7 days",
+}
+
+SLICING = "slicing"
+
+###################################################################################################################
+# Wall time of one rule (or phase), kept as a log-scale histogram so memory stays constant on long replays
+# Durations are in ns, each power of 2 is split in 4 buckets (percentiles within ~12%)
+
+def bucket(ns)-> int:
+    bits = ns.bit_length()
+    if bits <= 3:
+        return ns
+    return (bits - 2) * 4 + ((ns >> (bits - 3)) & 3)
+
+# Middle of the durations that fall in the bucket
+def bucket_value(index)-> float:
+    if index < 8:
+        return float(index)
+    bits, sub = index // 4 + 2, index % 4
+    return (4.5 + sub) * (1 << (bits - 3))
+
+class RuleStats:
+
+    __slots__ = ("invocations", "total_ns", "decided", "fired", "histogram")
+
+    def __init__(self):
+        self.invocations = 0
+        self.total_ns = 0
+        # Transactions denied by this case, and the ones where it failed (decided or not, see RuleProfiler.measure)
+        self.decided = 0
+        self.fired = 0
+        self.histogram = [0] * 256
+
+    def add(self, ns):
+        self.invocations += 1
+        self.total_ns += ns
+        self.histogram[bucket(ns)] += 1
+
+    def percentile(self, q)-> float:
+
+        if self.invocations == 0:
+            return float("nan")
+
+        rank = q / 100 * self.invocations
+        seen = 0
+        for index, count in enumerate(self.histogram):
+            seen += count
+            if count and seen >= rank:
+                return bucket_value(index)
+
+        return bucket_value(len(self.histogram) - 1)
+
+###################################################################################################################
+# Optional instrumentation of the scorers
+# analyzes_transaction(..., profiler=profiler) / ScoringEngine.profiler = profiler / process_database(profiler=...)
+# Without a profiler nothing is measured
+
+class RuleProfiler:
+
+    def __init__(self):
+        self.rules = {}
+        self.transactions = 0
+
+    def stats(self, name)-> RuleStats:
+        stats = self.rules.get(name)
+        if stats is None:
+            stats = self.rules[name] = RuleStats()
+        return stats
+
+    def record(self, name, ns):
+        self.stats(name).add(ns)
+
+    # Adds the measurements of another profiler (e.g. of another process, see src.parallel)
+    def merge(self, other):
+
+        self.transactions += other.transactions
+        for name, theirs in other.rules.items():
+            stats = self.stats(name)
+            stats.invocations += theirs.invocations
+            stats.total_ns += theirs.total_ns
+            stats.decided += theirs.decided
+            stats.fired += theirs.fired
+            stats.histogram = [mine + count for mine, count in zip(stats.histogram, theirs.histogram)]
+
+    # Calls a rule (True -> the transaction passes) without deciding the transaction, for the scorers that go on
+    # after a failing rule (all the rules, or out of case order), which then call decide with the deny case
+    def measure(self, case, rule, *args):
+
+        start = time.perf_counter_ns()
+        result = rule(*args)
+        stats = self.stats(case)
+        stats.add(time.perf_counter_ns() - start)
+
+        if not result:
+            stats.fired += 1
+
+        return result
+
+    def decide(self, case):
+        if case:
+            self.stats(case).decided += 1
+
+    # Calls a rule of a scorer that stops at the first failing one, which is the deciding case
+    def call(self, case, rule, *args):
+
+        result = self.measure(case, rule, *args)
+        if not result:
+            self.decide(case)
+
+        return result
+
+    #=============================================================================================================#
+
+    def summary(self)-> pd.DataFrame:
+
+        names = [SLICING] if SLICING in self.rules else []
+        names += sorted(name for name in self.rules if name != SLICING)
+
+        rows = []
+        for name in names:
+            stats = self.rules[name]
+            rows.append({
+                "rule": name,
+                "description": CASES.get(name, "History slicing"),
+                "invocations": stats.invocations,
+                "total_ms": stats.total_ns / 1e6,
+                "mean_us": stats.total_ns / stats.invocations / 1e3 if stats.invocations else float("nan"),
+                "p50_us": stats.percentile(50) / 1e3,
+                "p90_us": stats.percentile(90) / 1e3,
+                "p99_us": stats.percentile(99) / 1e3,
+                "decided": stats.decided if name != SLICING else None,
+                "fired": stats.fired if name != SLICING else None,
+            })
+
+        summary = pd.DataFrame(rows, columns=["rule", "description", "invocations", "total_ms", "mean_us", "p50_us",
+                                              "p90_us", "p99_us", "decided", "fired"])
+        summary["decided"] = summary["decided"].astype("Int64")
+        summary["fired"] = summary["fired"].astype("Int64")
+
+        return summary
+
+    def report(self)-> str:
+
+        summary = self.summary()
+        denied = sum(stats.decided for stats in self.rules.values())
+
+        lines = [f"{self.transactions} transactions profiled: {self.transactions - denied} approved, {denied} denied"]
+        if not summary.empty:
+            lines.append(summary.to_string(index=False, float_format=lambda value: f"{value:.2f}"))
+
+        return "\n".join(lines)
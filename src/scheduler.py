@@ -0,0 +1,206 @@
+import asyncio
+import threading
+import time
+
+from src.engine import paused_gc
+
+# Longest a request waits for others to join its batch, and the most requests decided in one batch
+BATCH_WINDOW_MS = 1
+BATCH_MAX_SIZE = 256
+
+###################################################################################################################
+# Requests decided together, each caller waits for its batch to be decided
+
+class Batch:
+
+    __slots__ = ("calls", "results", "errors", "first", "decided", "waiters")
+
+    def __init__(self):
+        # (function, arguments) of each request, then its result or the error it raised
+        self.calls = []
+        self.results = []
+        self.errors = {}
+
+        # Arrival of the first request (start of the batch window)
+        self.first = time.monotonic()
+
+        self.decided = False
+        # Futures of the coroutines waiting for the batch, released together (see release)
+        self.waiters = []
+
+    def result(self, index):
+
+        error = self.errors.get(index)
+        if error is not None:
+            raise error
+
+        return self.results[index]
+
+###################################################################################################################
+# Micro-batching scheduler in front of a ScoringEngine
+# Concurrent callers (threads or coroutines) submit transactions, which are collected for up to window_ms after the
+# first one (or until max_size are waiting) and decided as one batch with the garbage collector paused
+# Requests are decided in arrival order, each one seeing the ones submitted before it, so the decisions are the
+# same as calling decide one transaction at a time
+# No thread of its own: a waiting thread that finds no batch being decided decides the next one itself (the others
+# wait for it), and the coroutines are decided by a flush scheduled on their event loop
+
+class MicroBatcher:
+
+    # decide -> called with each submitted transaction (e.g. ScoringEngine.decide)
+    def __init__(self, decide, window_ms=BATCH_WINDOW_MS, max_size=BATCH_MAX_SIZE):
+        self.decide = decide
+        self.window = window_ms / 1000
+        self.max_size = max_size
+
+        # Batches not decided yet, in arrival order (only the last one takes new requests)
+        self.pending = []
+        self.condition = threading.Condition()
+
+        # Held while a batch is decided, the engine is only used by one batch at a time
+        self.combiner = threading.Lock()
+
+        # Flush scheduled on the event loop of the waiting coroutines
+        self.timer = None
+
+        self.batches = 0
+        self.requests = 0
+
+    # Queues function(*args) in order with the other requests, returns its batch and its index in the batch
+    def call(self, function, *args)-> tuple:
+
+        with self.condition:
+            if not self.pending or len(self.pending[-1].calls) >= self.max_size:
+                self.pending.append(Batch())
+            batch = self.pending[-1]
+            batch.calls.append((function, args))
+            if len(batch.calls) >= self.max_size:
+                self.condition.notify_all()
+
+        return batch, len(batch.calls) - 1
+
+    #=============================================================================================================#
+    # Threads
+
+    def score(self, transaction):
+        return self.call_wait(self.decide, transaction)
+
+    # Runs function(*args) in order with the submitted transactions (e.g. reading the metrics)
+    def call_wait(self, function, *args):
+
+        batch, index = self.call(function, *args)
+
+        while not batch.decided:
+            if self.combiner.acquire(blocking=False):
+                try:
+                    if not batch.decided:
+                        self.linger()
+                        self.decide_next()
+                finally:
+                    self.combiner.release()
+                    with self.condition:
+                        self.condition.notify_all()
+            else:
+                # Another caller is deciding: until it decides this batch or leaves the next one to this caller
+                with self.condition:
+                    if not batch.decided and self.combiner.locked():
+                        self.condition.wait()
+
+        return batch.result(index)
+
+    # Waits for the window of the next batch to close or for it to fill up
+    def linger(self):
+
+        with self.condition:
+            while self.pending and len(self.pending[0].calls) < self.max_size:
+                remaining = self.pending[0].first + self.window - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+    #=============================================================================================================#
+    # Coroutines
+
+    async def score_async(self, transaction):
+        return await self.call_async(self.decide, transaction)
+
+    async def call_async(self, function, *args):
+
+        batch, index = self.call(function, *args)
+        loop = asyncio.get_running_loop()
+
+        waiter = loop.create_future()
+        with self.condition:
+            if batch.decided:
+                return batch.result(index)
+            batch.waiters.append(waiter)
+
+        if len(batch.calls) >= self.max_size:
+            loop.call_soon(self.flush)
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window, self.flush)
+
+        await waiter
+
+        return batch.result(index)
+
+    def flush(self):
+
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        with self.combiner:
+            while self.pending:
+                self.decide_next()
+
+        # Threads that found the engine taken decide the batches submitted since
+        with self.condition:
+            self.condition.notify_all()
+
+    #=============================================================================================================#
+
+    def decide_next(self):
+
+        with self.condition:
+            if not self.pending:
+                return
+            batch = self.pending.pop(0)
+
+        results = batch.results
+        with paused_gc():
+            for index, (function, args) in enumerate(batch.calls):
+                # An error only fails its own request, the rest of the batch is still decided
+                try:
+                    results.append(function(*args))
+                except Exception as error:
+                    results.append(None)
+                    batch.errors[index] = error
+
+        with self.condition:
+            batch.decided = True
+            waiters = batch.waiters
+            self.condition.notify_all()
+
+        # One wakeup of the event loop per batch (decided by a thread or by the loop itself), none once it is closed
+        if waiters and not waiters[0].get_loop().is_closed():
+            waiters[0].get_loop().call_soon_threadsafe(release, waiters)
+
+        self.batches += 1
+        self.requests += len(batch.calls)
+
+    # Decides the requests still pending
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Cancelled callers are skipped, their requests are decided anyway
+def release(waiters):
+    for waiter in waiters:
+        if not waiter.done():
+            waiter.set_result(None)
@@ -0,0 +1,152 @@
+import asyncio
+import json
+
+import os
+
+from src.antifraud import OUTPUT_PATH
+from src.engine import RETENTION_LATE_HOURS, RETENTION_USER_DAYS
+from src.metrics import DecisionMetrics, metrics_path
+from src.scheduler import BATCH_MAX_SIZE, MicroBatcher
+from src.snapshot import open_engine
+
+HOST = "127.0.0.1"
+PORT = 8080
+
+# Decisions between saves of the metrics file
+METRICS_SAVE_EVERY = 1000
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+###################################################################################################################
+# Long-running scoring service
+# The history is loaded once into a ScoringEngine and every scored transaction (approved or denied) is added to it,
+# so the next decisions already see it
+
+# POST /score  {"transaction_id": 2342357, "merchant_id": 29744, "user_id": 97051, "card_number": "434505******9116",
+#               "transaction_date": "2019-11-30T23:16:32.812632", "transaction_amount": 373, "device_id": 285475}
+#           -> {"transaction_id": 2342357, "recommendation": "approve", "deny_case": 0}
+# GET  /health  -> {"status": "ok", "transactions": 3199}
+# GET  /metrics -> running decision metrics (see src.metrics), also saved to metrics_path every METRICS_SAVE_EVERY
+#                  decisions
+# With a src.scheduler.MicroBatcher the requests of concurrent connections are answered in micro-batches by its
+# worker, in arrival order
+
+class ScoringService:
+
+    def __init__(self, engine, metrics_path=None, batcher=None):
+        self.engine = engine
+        self.metrics_path = metrics_path
+        self.batcher = batcher
+
+        if engine.metrics is None:
+            engine.metrics = DecisionMetrics()
+
+    def score(self, transaction)-> dict:
+
+        # Classifies a transaction based on history and adds it to the history
+        decision = self.engine.decide(transaction)
+
+        if self.metrics_path is not None and self.engine.metrics.decisions % METRICS_SAVE_EVERY == 0:
+            self.engine.metrics.save(self.metrics_path)
+
+        return decision
+
+    def route(self, method, path, body):
+
+        if path == "/health":
+            return 200, {"status": "ok", "transactions": self.engine.size}
+
+        if path == "/metrics":
+            return 200, self.engine.metrics.to_dict()
+
+        if path != "/score":
+            return 404, {"error": f"Unknown path: {path}"}
+
+        if method != "POST":
+            return 405, {"error": "Use POST to score a transaction"}
+
+        try:
+            transaction = json.loads(body)
+            return 200, self.score(transaction)
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            return 400, {"error": f"Invalid transaction: {error!r}"}
+
+    #=============================================================================================================#
+    # Minimal HTTP/1.1 (keep-alive, JSON bodies with Content-Length)
+
+    async def handle(self, reader, writer):
+
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                if self.batcher is None:
+                    status, response = self.route(method, path.split("?", 1)[0], body)
+                else:
+                    status, response = await self.batcher.call_async(self.route, method, path.split("?", 1)[0], body)
+
+                payload = json.dumps(response).encode()
+                writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                             f"Content-Type: application/json\r\n"
+                             f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload)
+                await writer.drain()
+
+                if headers.get("connection", "").lower() == "close":
+                    break
+
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+
+        finally:
+            writer.close()
+
+    async def run(self, host, port):
+
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Scoring service listening on http://{host}:{port}/score")
+
+        async with server:
+            await server.serve_forever()
+
+###################################################################################################################
+
+# batch_window_ms -> answer concurrent requests in micro-batches collected over this window (see src.scheduler),
+#                    None answers each request as it arrives
+# params          -> rule parameters of the engine (see src.engine.ScoringEngine)
+def serve(host=HOST, port=PORT, history_path=OUTPUT_PATH, batch_window_ms=None, batch_size=BATCH_MAX_SIZE,
+          **params):
+
+    # Opening the processed history once, the metrics continue from the ones of the replay
+    # Transactions older than the rule windows are evicted as new ones arrive (constant memory however long it runs),
+    # the metrics remember the users forgotten during the last RETENTION_USER_DAYS
+    engine = open_engine(history_path, **params).retain(late_hours=RETENTION_LATE_HOURS,
+                                                         user_days=RETENTION_USER_DAYS)
+    path = metrics_path(history_path)
+    if os.path.exists(path):
+        engine.metrics = DecisionMetrics.load(path)
+
+    service = ScoringService(engine, path)
+    if batch_window_ms is not None:
+        service.batcher = MicroBatcher(service.score, batch_window_ms, batch_size)
+
+    try:
+        asyncio.run(service.run(host, port))
+    except KeyboardInterrupt:
+        print("Closing...")
+    finally:
+        if service.batcher is not None:
+            service.batcher.close()
+        engine.metrics.save(path)
@@ -0,0 +1,304 @@
+import json
+import os
+from array import array
+
+import numpy as np
+import pandas as pd
+
+from src.antifraud import OUTPUT_PATH
+from src.compact import MISSING
+from src.engine import HISTORY_COLUMNS, EntityHistory, ScoringEngine
+from src.store import is_store, open_store
+
+SNAPSHOT_VERSION = 1
+
+# Columns the engine reads from a history
+ENGINE_COLUMNS = ("transaction_date", "transaction_amount", "user_id", "card_number", "device_id", "merchant_id",
+                  "has_cbk")
+
+# Engine histories and the snapshot column that identifies each entity
+ENTITIES = (("users", "user_id"), ("cards", "card_code"), ("devices", "device_id"), ("merchants", "merchant_id"))
+
+###################################################################################################################
+# Binary snapshot of a processed history, written next to the result spreadsheet
+# One .npy file per column (opened memory-mapped) plus, for each entity, its rows grouped by key, so a scorer can
+# start without parsing the CSV and only reads the histories of the entities it actually sees
+
+def snapshot_path(csv_path)-> str:
+    return os.path.splitext(csv_path)[0] + ".snapshot"
+
+# Identifies the version of the spreadsheet the snapshot was built from
+def fingerprint(csv_path)-> dict:
+    stat = os.stat(csv_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def write_snapshot(historical, csv_path=OUTPUT_PATH):
+
+    path = snapshot_path(csv_path)
+    os.makedirs(path, exist_ok=True)
+
+    # The metadata is written last, an interrupted snapshot is never opened
+    if os.path.exists(os.path.join(path, "meta.json")):
+        os.remove(os.path.join(path, "meta.json"))
+
+    n = len(historical)
+    dates = pd.to_datetime(historical["transaction_date"]).to_numpy("datetime64[ns]").astype(np.int64)
+    cards, card_codes = np.unique(historical["card_number"].astype(str).to_numpy(), return_inverse=True)
+
+    columns = {
+        "transaction_id": historical["transaction_id"].to_numpy(np.int64),
+        "merchant_id": historical["merchant_id"].to_numpy(np.int64),
+        "user_id": historical["user_id"].to_numpy(np.int64),
+        "card_code": card_codes.astype(np.int32),
+        "transaction_date": dates,
+        "transaction_amount": historical["transaction_amount"].to_numpy(np.float64),
+        "device_id": historical["device_id"].to_numpy(np.float64),
+        "has_cbk": historical["has_cbk"].to_numpy(bool),
+        "deny_case": historical["deny_case"].to_numpy(np.int64),
+    }
+
+    # Bitmask of all the failing cases, when the replay evaluated them (process_database(all_rules=True))
+    fired_rules = "fired_rules" in historical
+    if fired_rules:
+        columns["fired_rules"] = historical["fired_rules"].to_numpy(np.int32)
+
+    for name, values in columns.items():
+        np.save(os.path.join(path, f"{name}.npy"), values)
+    np.save(os.path.join(path, "cards.npy"), cards.astype(str))
+
+    #-------------------------------------------------------------------------------------------------------------#
+    # Per-entity aggregates: sorted keys, offsets and the rows of each key in time order
+
+    rows = np.arange(n)
+    has_device = ~np.isnan(columns["device_id"])
+
+    for name, column in ENTITIES:
+        entity_rows = rows[has_device] if name == "devices" else rows
+        keys = columns[column][entity_rows].astype(np.int64)
+
+        order = np.lexsort((entity_rows, dates[entity_rows], keys))
+        unique, first = np.unique(keys[order], return_index=True)
+
+        np.save(os.path.join(path, f"{name}_keys.npy"), unique)
+        np.save(os.path.join(path, f"{name}_offsets.npy"), np.append(first, len(order)).astype(np.int64))
+        np.save(os.path.join(path, f"{name}_rows.npy"), entity_rows[order].astype(np.int64))
+
+    missing_cbks = dates[columns["has_cbk"] & ~has_device]
+
+    meta = {
+        "version": SNAPSHOT_VERSION,
+        "rows": n,
+        "source": fingerprint(csv_path),
+        "missing_device_cbk": int(missing_cbks.min()) if len(missing_cbks) else None,
+        "fired_rules": fired_rules,
+    }
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as file:
+        json.dump(meta, file)
+
+###################################################################################################################
+
+class Snapshot:
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+        self.arrays = {}
+
+    # Columns are memory-mapped on first use
+    def __getitem__(self, name):
+        if name not in self.arrays:
+            self.arrays[name] = np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+        return self.arrays[name]
+
+    def __len__(self)-> int:
+        return self.meta["rows"]
+
+    # The same DataFrame as pd.read_csv(csv_path, parse_dates=["transaction_date"]) (only columns when given)
+    def frame(self, columns=None):
+
+        columns_of = {
+            "transaction_id": lambda: self["transaction_id"],
+            "merchant_id": lambda: self["merchant_id"],
+            "user_id": lambda: self["user_id"],
+            "card_number": lambda: self["cards"][self["card_code"]].astype(object),
+            "transaction_date": lambda: np.asarray(self["transaction_date"]).view("datetime64[ns]"),
+            "transaction_amount": lambda: self["transaction_amount"],
+            "device_id": lambda: self["device_id"],
+            "has_cbk": lambda: self["has_cbk"],
+            "recommendation": lambda: np.where(np.asarray(self["deny_case"]) != 0, "deny", "approve").astype(object),
+            "deny_case": lambda: np.asarray(self["deny_case"]),
+        }
+        if self.meta.get("fired_rules"):
+            columns_of["fired_rules"] = lambda: np.asarray(self["fired_rules"])
+
+        columns = list(columns_of) if columns is None else columns
+        return pd.DataFrame({column: columns_of[column]() for column in columns})
+
+# Snapshot of the spreadsheet, or None when it is missing or older than the spreadsheet
+def open_snapshot(csv_path=OUTPUT_PATH):
+
+    path = snapshot_path(csv_path)
+
+    try:
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    if meta.get("version") != SNAPSHOT_VERSION:
+        return None
+
+    if os.path.exists(csv_path) and meta.get("source") != fingerprint(csv_path):
+        return None
+
+    return Snapshot(path, meta)
+
+###################################################################################################################
+# Engine histories read from the snapshot when an entity is first seen (new entities are only kept in memory)
+# Keyed by the engine's codes like the dictionaries they replace
+
+class LazyHistories:
+
+    def __init__(self, snapshot, name, encoders):
+        self.snapshot = snapshot
+        self.name = name
+        self.encoders = encoders
+        self.loaded = {}
+
+        self.keys = snapshot[f"{name}_keys"]
+        self.offsets = snapshot[f"{name}_offsets"]
+        self.rows = snapshot[f"{name}_rows"]
+
+    def get(self, key, default=None):
+
+        history = self.loaded.get(key)
+        if history is None:
+            history = self.read(key)
+            if history is None:
+                return default
+            self.loaded[key] = history
+
+        return history
+
+    def __getitem__(self, key):
+        history = self.get(key)
+        if history is None:
+            raise KeyError(key)
+        return history
+
+    def __setitem__(self, key, history):
+        self.loaded[key] = history
+
+    # Only the histories already read (see ScoringEngine.evict), a forgotten one is read again when seen
+    def __delitem__(self, key):
+        del self.loaded[key]
+
+    def items(self):
+        return self.loaded.items()
+
+    def __contains__(self, key):
+        return key in self.loaded
+
+    def read(self, code):
+
+        snapshot = self.snapshot
+        encoders = self.encoders
+        key = encoders[self.name].decode(code)
+
+        if self.name == "cards":
+            cards = snapshot["cards"]
+            i = np.searchsorted(cards, key)
+            if i == len(cards) or cards[i] != key:
+                return None
+            key = i
+
+        i = np.searchsorted(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return None
+
+        rows = np.asarray(self.rows[self.offsets[i]:self.offsets[i + 1]])
+        dates = snapshot["transaction_date"][rows] // 1000
+        cbks = snapshot["has_cbk"][rows]
+
+        devices = snapshot["device_id"][rows]
+        has_device = ~np.isnan(devices)
+        device_codes = np.full(len(rows), MISSING, dtype=np.int32)
+        device_codes[has_device] = encoders["devices"].encode_column(devices[has_device].astype(np.int64))
+
+        components, amounts = HISTORY_COLUMNS[self.name]
+
+        history = EntityHistory(components, amounts)
+        history.dates = array("q", dates.astype(np.int64).tobytes())
+        history.cbk_dates = array("q", dates[cbks].astype(np.int64).tobytes())
+        history.first_date = history.dates[0]
+        history.first_cbk = history.cbk_dates[0] if history.cbk_dates else None
+
+        if amounts:
+            history.amounts = array("d", snapshot["transaction_amount"][rows].astype(np.float64).tobytes())
+        if "users" in components:
+            history.users = array("i", encoders["users"].encode_column(snapshot["user_id"][rows]).tobytes())
+        if "cards" in components:
+            history.cards = array("i", encoders["cards"].encode_column(
+                snapshot["cards"][snapshot["card_code"][rows]].astype(object)).tobytes())
+        if "devices" in components:
+            history.devices = array("i", device_codes.tobytes())
+
+        return history
+
+###################################################################################################################
+# Engine over a processed history: from the snapshot when it is up to date, otherwise parsing the spreadsheet
+
+# csv_path may also be a columnar store (see src.store), then only its last days are loaded: enough for the
+# windows of the rules (or the given days), with the older days summarized by their aggregates
+def open_engine(csv_path=OUTPUT_PATH, days=None, **params)-> ScoringEngine:
+
+    engine = ScoringEngine(**params)
+
+    if is_store(csv_path):
+        return open_store_engine(engine, open_store(csv_path), days)
+
+    snapshot = open_snapshot(csv_path)
+
+    if snapshot is None:
+        return engine.load(pd.read_csv(csv_path, parse_dates=["transaction_date"]))
+
+    for name, _ in ENTITIES:
+        setattr(engine, name, LazyHistories(snapshot, name, engine.encoders))
+
+    # The snapshot keeps nanoseconds, the engine microseconds
+    missing_device_cbk = snapshot.meta["missing_device_cbk"]
+    engine.size = len(snapshot)
+    engine.missing_device_cbk = None if missing_device_cbk is None else missing_device_cbk // 1000
+
+    return engine
+
+def open_store_engine(engine, store, days=None)-> ScoringEngine:
+
+    last_date = store.last_date
+    if last_date is None:
+        return engine
+
+    # New transactions come after the last stored one, so no window reaches before start
+    if days is None:
+        start = (last_date - pd.Timedelta(microseconds=engine.horizon())).floor("D")
+    else:
+        start = last_date.floor("D") - pd.Timedelta(days=days - 1)
+
+    engine.fold(*store.aggregates(start))
+
+    return engine.load(store.read(ENGINE_COLUMNS, start=start))
+
+# Processed history as a DataFrame (same fallback as open_engine), only columns when given
+def read_history(csv_path=OUTPUT_PATH, columns=None):
+
+    if is_store(csv_path):
+        return open_store(csv_path).read(columns)
+
+    snapshot = open_snapshot(csv_path)
+    if snapshot is None:
+        if columns is None:
+            return pd.read_csv(csv_path, parse_dates=["transaction_date"])
+        dates = ["transaction_date"] if "transaction_date" in columns else False
+        return pd.read_csv(csv_path, usecols=columns, parse_dates=dates)[list(columns)]
+
+    return snapshot.frame(columns)
@@ -0,0 +1,293 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+STORE_VERSION = 1
+STORE_SUFFIX = ".store"
+# Kind of directory in meta.json (snapshots write a meta.json of their own, see src.snapshot)
+STORE_FORMAT = "store"
+
+# Entities with aggregates in each partition and the column that identifies them
+ENTITIES = (("users", "user_id"), ("cards", "card_number"), ("devices", "device_id"), ("merchants", "merchant_id"))
+
+# Aggregate columns of each entity (see partition_aggregates)
+AGGREGATES = ("key", "first_date", "cbks", "first_cbk")
+
+###################################################################################################################
+# Columnar storage of transactions partitioned by transaction day
+# <store>/meta.json lists the columns and the partitions, <store>/<day>/<column>.npy holds one column of one day
+# and <store>/<day>/aggregates/ the per-entity aggregates of that day, so a reader loads only the columns and days
+# it needs (projection and date pushdown) and summarizes older days without reading their rows
+# The CSV spreadsheets stay the import / export format (import_csv, export_csv)
+
+def store_path(csv_path)-> str:
+    return os.path.splitext(csv_path)[0] + STORE_SUFFIX
+
+# A store is named with STORE_SUFFIX or has the metadata file of a store (any other directory is not one)
+def is_store(path)-> bool:
+    return path.endswith(STORE_SUFFIX) or read_meta(path) is not None
+
+# Identifies the version of a spreadsheet or store (the metadata file of a store is replaced on every write)
+def source_fingerprint(path)-> dict:
+    stat = os.stat(os.path.join(path, "meta.json") if is_store(path) else path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def day_name(day)-> str:
+    return pd.Timestamp(day).strftime("%Y-%m-%d")
+
+# Column as a numpy array that np.load reads back without pickling (text columns as fixed width strings)
+def column_array(values)-> np.ndarray:
+    if values.dtype == object:
+        return values.astype(str).to_numpy(dtype=str)
+    return values.to_numpy()
+
+###################################################################################################################
+# Per-entity aggregates of one partition: first transaction, number of CBKs and first CBK of each key
+# Summed over the days before a date they are all the rules need from those days (see ScoringEngine.fold)
+
+def partition_aggregates(part)-> dict:
+
+    aggregates = {}
+    dates = part["transaction_date"]
+    cbk_dates = dates.where(part["has_cbk"].astype(bool))
+
+    for name, column in ENTITIES:
+
+        keys = part[column]
+        known = keys.notna()
+        keys = keys[known].astype(str if name == "cards" else np.int64)
+
+        frame = pd.DataFrame({"key": keys, "date": dates[known], "cbk": part["has_cbk"][known].astype(np.int64),
+                              "cbk_date": cbk_dates[known]})
+
+        aggregates[name] = frame.groupby("key", sort=True).agg(
+            first_date=("date", "min"), cbks=("cbk", "sum"), first_cbk=("cbk_date", "min")).reset_index()
+
+    return aggregates
+
+def merge_aggregates(frames)-> pd.DataFrame:
+    return pd.concat(frames, ignore_index=True).groupby("key", sort=True).agg(
+        first_date=("first_date", "min"), cbks=("cbks", "sum"), first_cbk=("first_cbk", "min")).reset_index()
+
+###################################################################################################################
+
+class Store:
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+
+    def __len__(self)-> int:
+        return sum(partition["rows"] for partition in self.meta["partitions"].values())
+
+    @property
+    def columns(self)-> list:
+        return list(self.meta["columns"])
+
+    @property
+    def days(self)-> list:
+        return sorted(self.meta["partitions"])
+
+    @property
+    def last_date(self):
+        partitions = self.meta["partitions"]
+        return pd.Timestamp(partitions[self.days[-1]]["last_date"]) if partitions else None
+
+    def load_column(self, day, column)-> np.ndarray:
+        return np.load(os.path.join(self.path, day, f"{column}.npy"), mmap_mode="r")
+
+    # Days of the partitions that can hold transactions between start (included) and end (excluded)
+    def select_days(self, start=None, end=None)-> list:
+        first = None if start is None else pd.Timestamp(start).floor("D")
+        end = None if end is None else pd.Timestamp(end)
+        return [day for day in self.days
+                if (first is None or pd.Timestamp(day) >= first) and (end is None or pd.Timestamp(day) < end)]
+
+    # columns -> projection (None for all of them)
+    # start   -> first transaction_date to read (included), end -> last one (excluded)
+    def read(self, columns=None, start=None, end=None)-> pd.DataFrame:
+
+        columns = self.columns if columns is None else list(columns)
+        days = self.select_days(start, end)
+        dtypes = self.meta["columns"]
+
+        def load(column):
+            parts = [self.load_column(day, column) for day in days]
+            return np.concatenate(parts) if parts else np.empty(0, dtype=np.dtype(dtypes[column]))
+
+        data = {column: load(column) for column in columns}
+        df = pd.DataFrame({column: values.astype(object) if dtypes[column] == "object" else values
+                           for column, values in data.items()}, columns=columns)
+
+        # Only the boundary partitions can hold rows outside the range
+        if start is not None or end is not None:
+            dates = data["transaction_date"] if "transaction_date" in data else load("transaction_date")
+            keep = np.ones(len(df), dtype=bool)
+            if start is not None:
+                keep &= dates >= pd.Timestamp(start).to_datetime64()
+            if end is not None:
+                keep &= dates < pd.Timestamp(end).to_datetime64()
+            if not keep.all():
+                df = df[keep].reset_index(drop=True)
+
+        return df
+
+    # Aggregates of the days before the day of end: ({entity: DataFrame of AGGREGATES}, rows, missing_device_cbk)
+    def aggregates(self, end)-> tuple:
+
+        last = day_name(end)
+        days = [day for day in self.days if day < last]
+        partitions = self.meta["partitions"]
+
+        aggregates = {}
+        for name, _ in ENTITIES:
+            frames = [pd.DataFrame({column: np.load(os.path.join(self.path, day, "aggregates",
+                                                                  f"{name}_{column}.npy"))
+                                    for column in AGGREGATES}) for day in days]
+            if frames:
+                aggregates[name] = merge_aggregates(frames)
+            else:
+                aggregates[name] = pd.DataFrame({"key": [], "first_date": pd.to_datetime([]), "cbks": [],
+                                                 "first_cbk": pd.to_datetime([])})
+
+        missing = [pd.Timestamp(partitions[day]["missing_device_cbk"]) for day in days
+                   if partitions[day]["missing_device_cbk"] is not None]
+        rows = sum(partitions[day]["rows"] for day in days)
+
+        return aggregates, rows, min(missing) if missing else None
+
+# Metadata of the store at path, or None when there is no complete store there
+def read_meta(path):
+
+    try:
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(meta, dict) or meta.get("format") != STORE_FORMAT or meta.get("version") != STORE_VERSION:
+        return None
+
+    return meta
+
+def open_store(path)-> Store:
+
+    meta = read_meta(path)
+    if meta is None:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No store at {path}")
+        raise ValueError(f"{path} is not a complete store")
+
+    return Store(path, meta)
+
+###################################################################################################################
+# Writing
+
+def write_meta(path, meta):
+
+    # Replaced atomically, readers see either the previous or the new list of partitions
+    temp_path = os.path.join(path, "meta.json.tmp")
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(meta, file)
+    os.replace(temp_path, os.path.join(path, "meta.json"))
+
+def write_partition(path, day, part)-> dict:
+
+    partition = os.path.join(path, day)
+    os.makedirs(os.path.join(partition, "aggregates"), exist_ok=True)
+
+    for column in part.columns:
+        np.save(os.path.join(partition, f"{column}.npy"), column_array(part[column]))
+
+    for name, aggregates in partition_aggregates(part).items():
+        for column in AGGREGATES:
+            np.save(os.path.join(partition, "aggregates", f"{name}_{column}.npy"), column_array(aggregates[column]))
+
+    missing_cbks = part["transaction_date"][part["has_cbk"].astype(bool) & part["device_id"].isna()]
+
+    return {
+        "rows": len(part),
+        "last_date": part["transaction_date"].max().isoformat(),
+        "missing_device_cbk": missing_cbks.min().isoformat() if len(missing_cbks) else None,
+    }
+
+# Adds transactions to the store (created when missing), the days they fall on are rewritten with the new rows
+# after the stored ones
+def append_store(df, path):
+
+    store = None if read_meta(path) is None else open_store(path)
+    if store is None:
+        # Never written into a directory that holds something else
+        if os.path.isdir(path) and os.listdir(path):
+            raise ValueError(f"{path} is not a store, not writing into it")
+        os.makedirs(path, exist_ok=True)
+        meta = {"format": STORE_FORMAT, "version": STORE_VERSION,
+                "columns": {column: str(dtype) for column, dtype in df.dtypes.items()}, "partitions": {}}
+    else:
+        meta = store.meta
+        if list(df.columns) != store.columns:
+            raise ValueError(f"Columns {list(df.columns)} do not match the store columns {store.columns}")
+
+    df = df.sort_values(by="transaction_date", kind="stable")
+    days = df["transaction_date"].dt.strftime("%Y-%m-%d")
+
+    for day, part in df.groupby(days, sort=True):
+        if store is not None and day in meta["partitions"]:
+            part = pd.concat([store.read(start=day, end=pd.Timestamp(day) + pd.Timedelta(days=1)), part],
+                             ignore_index=True)
+        meta["partitions"][day] = write_partition(path, day, part.reset_index(drop=True))
+
+    write_meta(path, meta)
+
+# Back to the given partitions ({day: partition metadata} saved earlier from the store's meta), dropping the rows
+# and the days written after them
+def truncate_store(path, partitions):
+
+    store = open_store(path)
+    meta = store.meta
+
+    for day in list(meta["partitions"]):
+        if day not in partitions:
+            shutil.rmtree(os.path.join(path, day))
+            del meta["partitions"][day]
+        elif meta["partitions"][day]["rows"] != partitions[day]["rows"]:
+            part = store.read(start=day, end=pd.Timestamp(day) + pd.Timedelta(days=1))
+            meta["partitions"][day] = write_partition(path, day, part.iloc[:partitions[day]["rows"]])
+
+    write_meta(path, meta)
+
+def write_store(df, path):
+
+    # Only a complete store (or an empty directory) is replaced, never any other directory
+    if os.path.isdir(path) and os.listdir(path):
+        if read_meta(path) is None:
+            raise ValueError(f"{path} is not a store, not replacing it")
+        shutil.rmtree(path)
+
+    append_store(df, path)
+
+###################################################################################################################
+# CSV import / export
+
+def import_csv(csv_path, path=None)-> str:
+
+    path = store_path(csv_path) if path is None else path
+    df = pd.read_csv(csv_path, parse_dates=["transaction_date"])
+
+    # The input spreadsheet has "TRUE" / "FALSE" CBK flags
+    if df["has_cbk"].dtype == object:
+        df["has_cbk"] = df["has_cbk"].astype(str).str.upper().map({"TRUE": True, "FALSE": False})
+
+    write_store(df, path)
+
+    return path
+
+def export_csv(path, csv_path=None)-> str:
+
+    csv_path = os.path.splitext(path)[0] + ".csv" if csv_path is None else csv_path
+    open_store(path).read().to_csv(csv_path, index=False, encoding="utf-8")
+
+    return csv_path
@@ -0,0 +1,75 @@
+import json
+import os
+import sys
+import time
+
+from src.antifraud import OUTPUT_PATH
+from src.engine import RETENTION_LATE_HOURS, ScoringEngine
+from src.snapshot import open_engine
+
+###################################################################################################################
+# Streaming scoring of JSONL transactions (one JSON object per line, same shape as the sample payload)
+# Lines are read, scored against the running history and written one at a time, so the input is never loaded up front
+
+def score_lines(lines, output, engine)-> tuple:
+
+    scored = 0
+    errors = 0
+
+    for number, line in enumerate(lines, start=1):
+
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            decision = engine.decide(json.loads(line))
+            scored += 1
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            decision = {"line": number, "error": f"Invalid transaction: {error!r}"}
+            errors += 1
+
+        output.write(json.dumps(decision) + "\n")
+
+    return scored, errors
+
+###################################################################################################################
+
+# input_path / output_path == "-" -> stdin / stdout
+# history_path                     -> processed history to start from (None starts with an empty history)
+# params                           -> rule parameters of the engine (see ScoringEngine)
+def stream(input_path="-", output_path="-", history_path=OUTPUT_PATH, **params):
+
+    if history_path is not None and os.path.exists(history_path):
+        engine = open_engine(history_path, **params)
+    else:
+        engine = ScoringEngine(**params)
+
+    # Transactions older than the rule windows are evicted as new ones arrive
+    engine.retain(late_hours=RETENTION_LATE_HOURS)
+
+    source = sys.stdin if input_path == "-" else open(input_path, encoding="utf-8")
+    output = sys.stdout if output_path == "-" else open(output_path, "w", encoding="utf-8")
+
+    start = time.perf_counter()
+    try:
+        scored, errors = score_lines(source, output, engine)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+        else:
+            output.flush()
+
+    elapsed = time.perf_counter() - start
+
+    # Throughput goes to stderr, stdout only carries the decisions
+    print(f"{scored} transactions scored ({errors} invalid) in {elapsed:.2f}s "
+          f"({scored / elapsed if elapsed else 0:.0f} transactions/s)", file=sys.stderr)
+
+###################################################################################################################
+
+# python -m src.stream [input.jsonl|-] [output.jsonl|-]
+if __name__ == "__main__":
+    stream(*sys.argv[1:3])
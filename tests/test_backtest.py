@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.antifraud import replay_engine
+from src.backtest import pairwise_sums, replay_vectorized, score_frame
+from src.generator import generate_frame
+
+# The vectorized backtest decides every transaction like the engine replay, with the same bitmask of the failing
+# cases in all-rules mode
+
+PARAMS = [
+    {},
+    {"amount_limit": 500, "time_window_hours": 48, "limit": 2, "cbk_limit": 1, "cbk_recent_days": 3,
+     "max_components": 3, "cbk_delay_days": 1},
+]
+
+@pytest.mark.parametrize("params", PARAMS)
+@pytest.mark.parametrize("seed", [1, 2])
+def test_vectorized_matches_engine(seed, params):
+
+    df = generate_frame(3000, seed=seed, days=15, users=150, merchants=30, cbk_rate=0.3, card_reuse_rate=0.1,
+                        device_reuse_rate=0.1)
+
+    expected = replay_engine(df, all_rules=True, **params)
+    result = replay_vectorized(df, all_rules=True, **params)
+
+    np.testing.assert_array_equal(result["deny_case"].to_numpy(), expected["deny_case"].to_numpy())
+    np.testing.assert_array_equal(result["fired_rules"].to_numpy(), expected["fired_rules"].to_numpy())
+    np.testing.assert_array_equal(score_frame(df, **params), expected["deny_case"].to_numpy())
+
+def test_empty_frame():
+
+    df = generate_frame(10, seed=1).iloc[:0]
+
+    deny_case, fired_rules = score_frame(df, all_rules=True)
+    assert len(deny_case) == 0 and len(fired_rules) == 0
+
+    result = replay_vectorized(df, all_rules=True)
+    assert list(result.columns) == list(df.columns) + ["recommendation", "deny_case", "fired_rules"]
+    assert result.empty
+
+# Window totals of any length are the same to the last bit as np.add.reduce of the window
+def test_pairwise_sums():
+
+    rng = np.random.default_rng(0)
+    values = np.round(rng.random(2000) * 10.0 ** rng.integers(0, 5, 2000), 2)
+    counts = np.arange(600)
+    starts = rng.integers(0, len(values) - 600, len(counts))
+
+    expected = [np.add.reduce(values[start:start + count]) if count else 0.0 for start, count in zip(starts, counts)]
+
+    np.testing.assert_array_equal(pairwise_sums(values, starts, counts), expected)
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from src.antifraud import replay_dataframe, replay_engine
+from src.generator import generate_frame
+
+# The engine replay decides every transaction like the DataFrame rules (analyzes_transaction) row by row
+
+PARAMS = [
+    {},
+    {"amount_limit": 500, "limit": 2, "cbk_limit": 1, "cbk_recent_days": 3, "max_components": 3,
+     "cbk_delay_days": 1, "high_value": 1500},
+]
+
+def dense_frame(seed):
+    return generate_frame(300, seed=seed, days=6, users=40, merchants=15, cbk_rate=0.3, card_reuse_rate=0.1,
+                          device_reuse_rate=0.1)
+
+@pytest.mark.parametrize("params", PARAMS)
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_engine_matches_dataframe(seed, params):
+
+    df = dense_frame(seed)
+
+    expected = replay_dataframe(df, **params)["deny_case"].to_numpy()
+    result = replay_engine(df, **params)["deny_case"].to_numpy()
+
+    np.testing.assert_array_equal(result, expected)
+    # Several cases decide some of the transactions
+    assert len(np.unique(expected)) > 3
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.antifraud import replay_engine
+from src.engine import ScoringEngine
+from src.generator import generate_frame
+from src.metrics import DecisionMetrics
+
+# Entities are forgotten (and their codes released) while the rows encoded ahead of scoring are replayed,
+# the decisions must be the same as without retention
+
+@pytest.fixture(scope="module")
+def frame():
+    return generate_frame(3000, seed=5, days=60, users=400, merchants=50, cbk_rate=0.3, card_reuse_rate=0.1,
+                          device_reuse_rate=0.1)
+
+@pytest.mark.parametrize("every", [1, 37, 1000])
+def test_retention_keeps_decisions(frame, every):
+
+    expected = replay_engine(frame, engine=ScoringEngine())["deny_case"].to_numpy()
+
+    engine = ScoringEngine().retain(every)
+    result = replay_engine(frame, engine=engine)["deny_case"].to_numpy()
+
+    np.testing.assert_array_equal(result, expected)
+
+    # Codes were released once the replay was over
+    assert engine.held is None
+    assert any(encoder.free for encoder in engine.encoders.values())
+
+@pytest.mark.parametrize("every", [1, 37])
+def test_retention_keeps_metrics(frame, every):
+
+    expected = ScoringEngine()
+    expected.metrics = DecisionMetrics()
+    replay_engine(frame, engine=expected)
+
+    engine = ScoringEngine().retain(every)
+    engine.metrics = DecisionMetrics()
+    replay_engine(frame, engine=engine)
+
+    assert engine.metrics.to_dict() == expected.metrics.to_dict()
+    assert engine.forgotten_users
+
+# Users that are seen for a few days and never come back: with metrics on (as in the service) the resident state
+# levels off instead of growing with every user
+def test_retention_memory_levels_off():
+
+    rows = 12000
+    frame = pd.DataFrame({
+        "transaction_id": np.arange(rows),
+        "merchant_id": np.arange(rows) % 20,
+        "user_id": np.arange(rows) // 6,
+        "card_number": (np.arange(rows) // 6).astype(str),
+        "transaction_date": pd.Timestamp("2019-01-01") + pd.to_timedelta(np.arange(rows) * 15, unit="min"),
+        "transaction_amount": 100.0,
+        "device_id": (np.arange(rows) // 6).astype(float),
+        "has_cbk": False,
+    })
+
+    engine = ScoringEngine().retain(100, user_days=20)
+    engine.metrics = DecisionMetrics()
+
+    def resident()-> int:
+        return (sum(len(entities) for entities in (engine.users, engine.cards, engine.devices, engine.merchants))
+                + len(engine.forgotten_users))
+
+    sizes = []
+    for start in range(0, rows, rows // 4):
+        replay_engine(frame.iloc[start:start + rows // 4].reset_index(drop=True), engine=engine)
+        sizes.append(resident())
+
+    # 2000 users over 125 days, only the last 20 days (plus the rule windows) of them are kept
+    assert sizes[-1] <= sizes[1] * 1.1
+    assert sizes[-1] < rows // 6